@@ -0,0 +1,145 @@
+# Measure cache size and load time before and after migrating old-style
+# .json entries to the compact transcript and chat formats.
+#
+#   python scripts/bench_cache.py ~/.cache/talk2pdf
+#   python scripts/bench_cache.py --synthetic 50
+#
+# Entries are copied to a temporary cache and migrated there, so the source
+# directory is left as it is. --synthetic makes whisper- and chat-shaped
+# entries instead, for when there is no old cache to measure.
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import talk2pdf.cache as cache
+import talk2pdf.config as config
+
+
+def _synthetic_transcript(rng, n_segments):
+    segments = []
+    t = 0.0
+    for i in range(n_segments):
+        words = rng.randint(6, 16)
+        end = t + words * 0.35
+        segments += [{
+            "id": i, "seek": int(t * 100), "start": t, "end": end,
+            "text": " " + " ".join("word" for _ in range(words)),
+            "tokens": [rng.randint(0, 50000) for _ in range(words + 2)],
+            "temperature": 0.0, "avg_logprob": -rng.random(),
+            "compression_ratio": 1 + rng.random(), "no_speech_prob": rng.random(),
+        }]
+        t = end + rng.random()
+    return {"text": "".join(s["text"] for s in segments), "segments": segments, "language": "en"}
+
+
+def _synthetic_response(rng):
+    content = "\n\n".join(" ".join("word" for _ in range(rng.randint(40, 120)))
+                          for _ in range(5))
+    return {"id": "chatcmpl-x", "object": "chat.completion", "created": 0, "model": "gpt-3.5-turbo",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 800, "completion_tokens": 700, "total_tokens": 1500}}
+
+
+def _write_synthetic(out_dir, n):
+    rng = random.Random(0)
+    for i in range(n):
+        with open(out_dir / f"transcript{i:04d}.json", 'w') as f:
+            f.write(json.dumps(_synthetic_transcript(rng, 300)))
+        with open(out_dir / f"response{i:04d}.json", 'w') as f:
+            f.write(json.dumps(_synthetic_response(rng)))
+
+
+def _size(paths):
+    return sum(p.stat().st_size for p in paths)
+
+
+# the text and start of every segment, and the content of every response,
+# which is what the pipeline reads from a cache entry
+def _touch(entry):
+    if "segments" in entry:
+        return sum(len(s["text"]) + int(s["start"] >= 0) for s in entry["segments"])
+    return len(entry["content"])
+
+
+def _load_legacy(paths):
+    n = 0
+    for path in paths:
+        with open(path, 'r') as f:
+            entry = json.loads(f.read())
+        if "choices" in entry:
+            entry = {"content": entry["choices"][0]["message"]["content"]}
+        n += _touch(entry)
+    return n
+
+
+def _load(transcripts, responses):
+    n = 0
+    for digest in transcripts:
+        n += _touch(cache.load_transcript(digest))
+    for digest in responses:
+        n += _touch(cache.load_response(digest))
+    return n
+
+
+def _timed(f):
+    # keep the cache's progress output out of the report
+    with contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        f()
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cache format benchmark")
+    parser.add_argument('cache_dir', nargs='?', type=Path,
+                        help="a cache directory with old-style .json entries")
+    parser.add_argument('--synthetic', type=int, metavar="N",
+                        help="measure N synthetic transcripts and N chat responses instead")
+    args = parser.parse_args()
+
+    config.load()
+    with tempfile.TemporaryDirectory() as d:
+        work_dir = Path(d)
+        if args.synthetic:
+            _write_synthetic(work_dir, args.synthetic)
+        else:
+            src = args.cache_dir or config.get(config.KEY_CACHE_DIR)
+            for path in Path(src).glob("*.json"):
+                shutil.copy(path, work_dir)
+        config.override(config.KEY_CACHE_DIR, work_dir)
+
+        legacy = sorted(work_dir.glob("*.json"))
+        transcripts = []
+        responses = []
+        for path in legacy:
+            with open(path, 'r') as f:
+                entry = json.loads(f.read())
+            if "segments" in entry:
+                transcripts += [path.stem]
+            elif "choices" in entry:
+                responses += [path.stem]
+        legacy = [work_dir / f"{digest}.json" for digest in transcripts + responses]
+        print(f"{len(transcripts)} transcripts, {len(responses)} chat responses")
+
+        legacy_bytes = _size(legacy)
+        legacy_s = _timed(lambda: _load_legacy(legacy))
+        migrate_s = _timed(lambda: _load(transcripts, responses))
+        compact = sorted(work_dir.glob("*.seg")) + \
+            sorted(work_dir.glob("*.chat"))
+        compact_bytes = _size(compact)
+        compact_s = _timed(lambda: _load(transcripts, responses))
+
+        print("format    bytes        load_s")
+        print(f"json      {legacy_bytes:11d}  {legacy_s:8.4f}")
+        print(f"compact   {compact_bytes:11d}  {compact_s:8.4f}")
+        if compact_bytes and compact_s:
+            print(f"{legacy_bytes / compact_bytes:.1f}x smaller, {legacy_s / compact_s:.1f}x faster to load"
+                  f" (one-time migration took {migrate_s:.4f}s)")
@@ -0,0 +1,46 @@
+# Measure windowed whisper transcription speedup against the number of workers.
+#
+#   python scripts/bench_whisper_parallel.py talk.mp3 --workers 1 2 4 8 16
+#
+# The baseline is a single whole-file transcription in this process, the way
+# talk2pdf transcribes a chunk without --whisper-workers. Nothing is cached.
+
+import argparse
+import difflib
+import os
+import time
+
+import talk2pdf.t2p_whisper as t2p_whisper
+
+
+def _text(segments):
+    return "".join(seg["text"] for seg in segments)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="parallel whisper transcription benchmark")
+    parser.add_argument('audio', help="an audio or video file")
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores")
+
+    model = t2p_whisper.ensure_model()
+    start = time.monotonic()
+    baseline = model.transcribe(args.audio, verbose=None)
+    serial = time.monotonic() - start
+    print(f"serial: {serial:.2f}s, {len(baseline['segments'])} segments")
+
+    print("workers  elapsed_s  speedup  efficiency  text_similarity")
+    for workers in args.workers:
+        # start the pool and load its models outside the timed region
+        t2p_whisper.ensure_workers(workers)
+        start = time.monotonic()
+        result = t2p_whisper.transcribe_windows(args.audio, workers)
+        elapsed = time.monotonic() - start
+        similarity = difflib.SequenceMatcher(
+            None, _text(baseline["segments"]), _text(result["segments"])).ratio()
+        speedup = serial / elapsed
+        print(f"{workers:7d}  {elapsed:9.2f}  {speedup:7.2f}  {speedup / workers:10.2f}  {similarity:15.3f}")
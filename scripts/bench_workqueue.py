@@ -0,0 +1,71 @@
+# Measure how well the SQLite work queue scales with local worker processes.
+#
+#   python scripts/bench_workqueue.py --items 64 --work-s 0.25 --workers 1 2 4 8
+#
+# Each item is a fixed amount of CPU work standing in for a chunk. For each
+# worker count a coordinator publishes the items, starts that many worker
+# processes, and waits for the results in order.
+
+import argparse
+import hashlib
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+import talk2pdf.workqueue as workqueue
+
+
+def _burn(payload):
+    # hash until the item's time is up, like a chunk being transcribed
+    h = hashlib.md5(str(payload["idx"]).encode('utf-8'))
+    deadline = time.process_time() + payload["work_s"]
+    while time.process_time() < deadline:
+        for _ in range(1000):
+            h.update(h.digest())
+    return {"idx": payload["idx"]}
+
+
+def _worker(queue_path):
+    queue = workqueue.WorkQueue(queue_path)
+    workqueue.work(queue, {"burn": _burn}, exit_when_idle=True, poll_s=0.05,
+                   idle_grace_s=0)
+    queue.close()
+
+
+def _run(queue_path, items, work_s, workers):
+    job = f"bench-{workers}"
+    queue = workqueue.WorkQueue(queue_path)
+    start = time.monotonic()
+    queue.publish(job, "burn", [{"idx": i, "work_s": work_s}
+                  for i in range(items)])
+    procs = [multiprocessing.Process(target=_worker, args=(queue_path,))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    results = queue.wait(job, "burn", poll_s=0.05)
+    elapsed = time.monotonic() - start
+    queue.close_job(job)
+    for p in procs:
+        p.join()
+    queue.close()
+    assert [r["idx"] for r in results] == list(range(items))
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="work queue scaling benchmark")
+    parser.add_argument('--items', type=int, default=64)
+    parser.add_argument('--work-s', type=float, default=0.25)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        queue_path = Path(d) / "queue.sqlite"
+        serial = args.items * args.work_s
+        print(f"{args.items} items x {args.work_s}s = {serial:.2f}s of work")
+        print("workers  elapsed_s  speedup  efficiency")
+        for workers in args.workers:
+            elapsed = _run(queue_path, args.items, args.work_s, workers)
+            speedup = serial / elapsed
+            print(f"{workers:7d}  {elapsed:9.2f}  {speedup:7.2f}  {speedup / workers:10.2f}")
@@ -0,0 +1,79 @@
+# A local stand-in for the OpenAI endpoints talk2pdf uses.
+#
+#   python scripts/fake_openai.py --port 8089 --fail-rate 0.3 --latency 0.2
+#   OPENAI_API_BASE=http://127.0.0.1:8089/v1 python -m talk2pdf ...
+#
+# --fail-rate of requests get a 429 with a Retry-After header, so retries,
+# backoff and the per-endpoint metrics can be exercised without a real key.
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _transcript(audio_bytes):
+    segments = []
+    for i in range(max(1, audio_bytes // 16000)):
+        segments += [{"id": i, "start": 5.0 * i, "end": 5.0 * (i + 1),
+                      "text": f" Fake segment number {i} of the talk."}]
+    return {"text": "".join(s["text"] for s in segments), "segments": segments}
+
+
+def _chat(body):
+    text = body["messages"][-1]["content"].split("\n", 1)[-1]
+    return {
+        "choices": [{"message": {"role": "assistant", "content": text}}],
+        "usage": {"total_tokens": len(text) // 4},
+    }
+
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, obj, headers={}):
+            raw = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(args.latency)
+
+            if not self.headers.get("Authorization", "").startswith("Bearer "):
+                self._reply(401, {"error": "missing key"})
+            elif random.random() < args.fail_rate:
+                self._reply(429, {"error": "slow down"},
+                            {"Retry-After": str(args.retry_after)})
+            elif self.path == "/v1/audio/translations":
+                self._reply(200, _transcript(len(body)))
+            elif self.path == "/v1/chat/completions":
+                self._reply(200, _chat(json.loads(body)))
+            else:
+                self._reply(404, {"error": f"no such endpoint {self.path}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI API server")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"serving on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
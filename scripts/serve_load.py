@@ -0,0 +1,78 @@
+# Submit a burst of jobs to a running `talk2pdf serve` and report throughput.
+#
+#   python -m talk2pdf serve --workers 2 &
+#   python scripts/serve_load.py --jobs 20 talk1.mp4 talk2.mp4
+#
+# URIs are submitted round-robin with random priorities, all at once, then
+# polled until every job has finished.
+
+import argparse
+import json
+import random
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _request(url, body=None):
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    req = urllib.request.Request(
+        url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def _percentile(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="talk2pdf serve load test")
+    parser.add_argument('URI', nargs='+', help="video files or URLs to submit")
+    parser.add_argument('--server', default="http://127.0.0.1:8080")
+    parser.add_argument('--jobs', type=int, default=10)
+    parser.add_argument('--poll', type=float, default=0.5)
+    args = parser.parse_args()
+
+    def submit(i):
+        body = {"uri": args.URI[i % len(args.URI)],
+                "priority": random.randint(0, 20)}
+        start = time.monotonic()
+        status, job = _request(f"{args.server}/jobs", body)
+        return status, job, time.monotonic() - start
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(args.jobs, 32)) as pool:
+        submissions = list(pool.map(submit, range(args.jobs)))
+
+    accepted = [job for status, job, _ in submissions if status == 202]
+    rejected = len(submissions) - len(accepted)
+    submit_latencies = [lat for _, _, lat in submissions]
+    print(f"submitted {args.jobs} jobs: {len(accepted)} accepted, {rejected} rejected")
+    print(f"submit latency p50 {_percentile(submit_latencies, 0.5) * 1000:.1f}ms "
+          f"p95 {_percentile(submit_latencies, 0.95) * 1000:.1f}ms")
+
+    pending = {job["id"] for job in accepted}
+    finished = []
+    while pending:
+        time.sleep(args.poll)
+        for job_id in list(pending):
+            _, job = _request(f"{args.server}/jobs/{job_id}")
+            if job["status"] in ("done", "failed"):
+                pending.remove(job_id)
+                finished += [job]
+    elapsed = time.monotonic() - start
+
+    if finished:
+        turnaround = [job["finished"] - job["submitted"] for job in finished]
+        failed = sum(1 for job in finished if job["status"] == "failed")
+        print(f"{len(finished)} jobs finished in {elapsed:.2f}s "
+              f"({len(finished) / elapsed:.3f} jobs/s), {failed} failed")
+        print(f"turnaround mean {statistics.mean(turnaround):.2f}s "
+              f"p50 {_percentile(turnaround, 0.5):.2f}s p95 {_percentile(turnaround, 0.95):.2f}s")
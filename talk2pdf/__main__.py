@@ -1,12 +1,8 @@
 import sys
-import subprocess
-from datetime import datetime
 from pathlib import Path
 import argparse
 import hashlib
 import struct
-import difflib
-from collections import namedtuple
 import json
 
 from pydub import AudioSegment, silence
@@ -17,12 +13,15 @@ import talk2pdf.t2p_openai as t2p_openai
 import talk2pdf.t2p_whisper as t2p_whisper
 import talk2pdf.t2p_ffmpeg as t2p_ffmpeg
 import talk2pdf.ytdlp as ytdlp
+import talk2pdf.serve as serve
+import talk2pdf.render as render
+import talk2pdf.plan as plan
+import talk2pdf.cache as cache
+import talk2pdf.workqueue as workqueue
+import talk2pdf.align as align
 
-Block = namedtuple("Block", ["text", "when", "image_path"])
-
-TODAY_STRING = datetime.today().strftime('%b %d, %Y')
-CHATGPT_MAX_STRING_LEN = 3000
-OPENAI_AUDIO_LIMIT_BYTES = 1024 * 1024 * 25
+WORK_TRANSCRIBE = "transcribe"
+WORK_CLEAN = "clean"
 
 
 def _chunk_path(digest, i):
@@ -105,7 +104,9 @@ def _export_spans(audio, spans, seed):
         if not path.is_file():
             utils.eprint(f"==== write {path} for {span[0],span[1]}")
             c = audio[span[0]:span[1]]
-            c.export(path)
+            tmp = utils.tmp_path(path)
+            c.export(tmp, format="mp3")
+            tmp.replace(path)
         paths += [path]
     return paths
 
@@ -117,36 +118,31 @@ def _transcribe_files(paths, at_sandia):
         utils.eprint(f"==== transcribe {path}")
 
         method = config.get(config.KEY_TRANSCRIBE)
-        if method == config.TRANSCRIBE_OPENAI_WHISPER:
-            transcript = t2p_whisper.transcribe(path)
-        elif method == config.TRANSCRIBE_OPENAI:
-            if at_sandia:
-                utils.set_requests_ca_bundle()
-            transcript = t2p_openai.transcribe(path)
-        else:
-            raise RuntimeError(f"unsupported transcribe method {method}")
+        # hash the chunk once, for both the cache check and the transcription
+        digest = plan.transcript_digest(path)
+        cached = cache.has_transcript(digest)
+        with plan.Timer() as timer:
+            if method == config.TRANSCRIBE_OPENAI_WHISPER:
+                transcript = t2p_whisper.transcribe(path, digest)
+            elif method == config.TRANSCRIBE_OPENAI:
+                if at_sandia:
+                    t2p_openai.set_ca_bundle(utils.sandia_ca_bundle())
+                transcript = t2p_openai.transcribe(path, digest)
+            else:
+                raise RuntimeError(f"unsupported transcribe method {method}")
+        if not cached:
+            plan.record(f"{plan.STAGE_TRANSCRIBE}:{method}",
+                        path.stat().st_size, timer.elapsed)
         transcripts += [transcript]
 
     return transcripts
 
 
-def _combine_segments(segments, max_length):
-    chunk = ""
-    chunks = []
-    for seg in segments:
-        if len(chunk) + len(seg["text"]) < CHATGPT_MAX_STRING_LEN:
-            chunk += seg["text"]
-        else:  # save chunk and start a new one
-            chunks += [chunk.strip()]
-            chunk = ""
-    if chunk != "":
-        chunks += [chunk.strip()]
-    return chunks
-
-
+# returns the cleaned texts and the cache digest of each
 def _clean_texts(texts, at_sandia):
 
     cleans = []
+    digests = []
     for text in texts:
         # continuing an incomplete line seems to make ChatGPT hallucinate
         text = text.strip()
@@ -155,9 +151,60 @@ def _clean_texts(texts, at_sandia):
         text + "\n\n"
 
         if at_sandia:
-            utils.set_requests_ca_bundle()
-        cleans += [t2p_openai.clean(text)]
-    return cleans
+            t2p_openai.set_ca_bundle(utils.sandia_ca_bundle())
+        digest = t2p_openai.clean_digest(text)
+        cached = cache.has_response(digest)
+        with plan.Timer() as timer:
+            cleans += [t2p_openai.clean(text)]
+        if not cached:
+            plan.record(plan.STAGE_CLEAN, 1, timer.elapsed)
+        digests += [digest]
+    return cleans, digests
+
+
+# what a worker does with each kind of item from the work queue
+def _work_handlers(at_sandia):
+    def transcribe(payload):
+        transcript, = _transcribe_files([Path(payload["path"])], at_sandia)
+        return [{"text": seg["text"], "start": seg["start"]}
+                for seg in transcript["segments"]]
+
+    def clean(payload):
+        cleans, digests = _clean_texts([payload["text"]], at_sandia)
+        return {"text": cleans[0], "digest": digests[0]}
+
+    return {WORK_TRANSCRIBE: transcribe, WORK_CLEAN: clean}
+
+
+# like _transcribe_files, but by workers sharing queue_path.
+# paths must be on storage the workers can see. The job stays open for the
+# cleaning that follows, unless transcription fails
+def _transcribe_queued(queue_path, video_digest, paths):
+    queue = workqueue.WorkQueue(queue_path)
+    try:
+        queue.publish(video_digest, WORK_TRANSCRIBE,
+                      [{"path": str(path)} for path in paths])
+        results = queue.wait(video_digest, WORK_TRANSCRIBE)
+    except BaseException:
+        queue.close_job(video_digest)
+        raise
+    finally:
+        queue.close()
+    return [{"segments": segments} for segments in results]
+
+
+# like _clean_texts, but by workers sharing queue_path. This is the job's
+# last phase, so workers waiting for more of it are released afterwards
+def _clean_queued(queue_path, video_digest, texts):
+    queue = workqueue.WorkQueue(queue_path)
+    try:
+        queue.publish(video_digest, WORK_CLEAN,
+                      [{"text": text} for text in texts])
+        results = queue.wait(video_digest, WORK_CLEAN)
+    finally:
+        queue.close_job(video_digest)
+        queue.close()
+    return [r["text"] for r in results], [r["digest"] for r in results]
 
 
 def _do_video_file(video_path, title, at_sandia, url=None):
@@ -168,8 +215,21 @@ def _do_video_file(video_path, title, at_sandia, url=None):
     video_digest = utils.hash_file(video_path)
     utils.eprint(f"==== video digest: {video_digest}")
 
+    # serve runs jobs concurrently, and jobs for the same talk share every
+    # intermediate file and the output, so they take turns
+    with utils.keyed_lock(video_digest):
+        return _do_video(video_path, video_digest, title, at_sandia, url)
+
+
+def _do_video(video_path, video_digest, title, at_sandia, url):
+
     audio_path = config.get(config.KEY_CACHE_DIR) / f"{video_digest}.mp3"
-    t2p_ffmpeg.extract_audio(audio_path, video_path)
+    cached = audio_path.is_file()
+    with plan.Timer() as timer:
+        t2p_ffmpeg.extract_audio(audio_path, video_path)
+    if not cached:
+        plan.record(plan.STAGE_EXTRACT_AUDIO,
+                    t2p_ffmpeg.video_duration(video_path), timer.elapsed)
 
     utils.eprint(f"==== load {audio_path}")
     if audio_path.suffix == ".mp3":
@@ -186,21 +246,29 @@ def _do_video_file(video_path, title, at_sandia, url=None):
 
     bytes_per_second = audio_size / audio_time
 
-    seconds_for_openai_limit = OPENAI_AUDIO_LIMIT_BYTES / bytes_per_second
+    seconds_for_openai_limit = config.OPENAI_AUDIO_LIMIT_BYTES / bytes_per_second
     seconds_for_openai_limit *= 0.9  # fudge to make sure we're under the limit
     utils.eprint(f"==== estimate {seconds_for_openai_limit}s per audio chunk")
     ms_for_openai_limit = seconds_for_openai_limit * 1000
 
-    noise_spans = _detect_noise_with_backoff(full_segment, ms_for_openai_limit)
-    utils.eprint(f"==== {len(noise_spans)} raw noisy spans")
+    with plan.Timer() as timer:
+        noise_spans = _detect_noise_with_backoff(
+            full_segment, ms_for_openai_limit)
+        utils.eprint(f"==== {len(noise_spans)} raw noisy spans")
 
-    noise_spans = _combine_spans(noise_spans, ms_for_openai_limit)
-    utils.eprint(f"==== combined to {len(noise_spans)} audio spans")
+        noise_spans = _combine_spans(noise_spans, ms_for_openai_limit)
+        utils.eprint(f"==== combined to {len(noise_spans)} audio spans")
 
-    noise_paths = _export_spans(full_segment, noise_spans, video_digest)
-    assert len(noise_paths) == len(noise_spans)
+        noise_paths = _export_spans(full_segment, noise_spans, video_digest)
+        assert len(noise_paths) == len(noise_spans)
+    plan.record(plan.STAGE_SPLIT, audio_time, timer.elapsed)
 
-    transcripts = _transcribe_files(noise_paths, at_sandia)
+    queue_path = config.get(config.KEY_WORK_QUEUE)
+    if queue_path is None:
+        transcripts = _transcribe_files(noise_paths, at_sandia)
+    else:
+        transcripts = _transcribe_queued(
+            queue_path, video_digest, noise_paths)
 
     full_transcript = {"segments": []}
     assert len(noise_spans) == len(transcripts)
@@ -211,161 +279,117 @@ def _do_video_file(video_path, title, at_sandia, url=None):
                 "start": seg["start"] + span[0] / 1000.0,
             }]
 
-    chunks = _combine_segments(
-        full_transcript["segments"], CHATGPT_MAX_STRING_LEN)
+    chunks = align.combine_segments(
+        full_transcript["segments"], config.CHATGPT_MAX_STRING_LEN)
 
-    clean_chunks = _clean_texts(chunks, at_sandia)
+    if queue_path is None:
+        clean_chunks, clean_digests = _clean_texts(chunks, at_sandia)
+    else:
+        clean_chunks, clean_digests = _clean_queued(
+            queue_path, video_digest, chunks)
 
     # each chunk may have multiple paragraphs in it
     blocks = []
     for chunk in clean_chunks:
         for paragraph in chunk.split("\n\n"):
-            blocks += [Block(paragraph, None, None)]
+            blocks += [align.Block(paragraph, None, None)]
 
     utils.eprint(f'==== {len(blocks)} blocks')
 
-    # Find a timestamp for the beginning of each paragraph
-    # Do this by comparing the beginning of the paragraph to each segment
-    # When we find the matching segment, we have a timestamp for the beginning of the paragraph
-    later_than = -1
-    blocks_with_starts = []
-    for block in blocks:
-
-        # find the first segment after no_earlier_than which matches the paragraph
-        found = False
-        for seg in full_transcript["segments"]:
-            if seg["start"] < later_than:
-                continue
-
-            # compare the beginning of p and seg["text"],
-            # consider seg["text"] to be the beginning of p if the match is close
-
-            s = difflib.SequenceMatcher(
-                lambda c: 0, block.text[:len(seg["text"])], seg["text"])
-            if s.ratio() > 0.8:
-                when = float(seg["start"])
-                later_than = when
-                utils.eprint(
-                    f'======== matched "{block.text[:25]}... to {seg["text"][:25]}..." at {when:.2f}s (score={s.ratio():.2f})')
-                blocks_with_starts += [Block(block.text, when, None)]
-                found = True
-                break
-
-        if not found:
-            # couldn't find a timestamp for this paragraph
-            blocks_with_starts += [Block(block.text, None, None)]
-            utils.eprint(
-                f"======== WARN: couldn't find any segments in {block.text}!")
-            sys.exit(1)
+    blocks_with_starts = align.align_blocks(
+        blocks, full_transcript["segments"])
+    if any(block.when is None for block in blocks_with_starts):
+        sys.exit(1)
 
-    md_path = config.get(config.KEY_CACHE_DIR) / f"{video_digest}.md"
-    pdf_path = f"{video_digest}.pdf"
+    def frame_for(when):
+        cached = t2p_ffmpeg.frame_path(
+            config.get(config.KEY_CACHE_DIR), video_path, when).is_file()
+        with plan.Timer() as timer:
+            frame_path = t2p_ffmpeg.extract_frame(
+                config.get(config.KEY_CACHE_DIR), video_path, when)
+        if not cached:
+            plan.record(plan.STAGE_FRAMES, 1, timer.elapsed)
+        return frame_path
 
-    blocks_with_images = []
-    for bi, block in enumerate(blocks_with_starts):
+    blocks_with_images, frame_paths = align.select_frames(
+        blocks_with_starts, frame_for)
 
-        # This block has a time, so extract an image
-        if block.when is not None:
-            frame_path = t2p_ffmpeg.extract_frame(
-                config.get(config.KEY_CACHE_DIR), video_path, block.when)
-
-            # only include this image if it's different enough from
-            # an image in a previous block, or it's the first block
-            if bi == 0:
-                blocks_with_images += [Block(block.text,
-                                             block.when, frame_path)]
-                recent_frame_path = frame_path
-            elif not utils.is_same_image(frame_path, recent_frame_path):
-                blocks_with_images += [
-                    Block(block.text, block.when, frame_path)]
-                recent_frame_path = frame_path
-                utils.eprint(
-                    f"==== image for block {bi} is new")
-            else:
-                # no image to include, it's the same as the most recent image
-                blocks_with_images += [block]
-        else:
-            # don't know when this block is, can't add an image
-            blocks_with_images += [block]
-
-    # write document header
-    with open(md_path, 'w') as f:
-
-        f.write(f"""---
-title: "{title}"
-author: talk2pdf (by Carl Pearson)
-date: {TODAY_STRING}
-geometry: "left=2cm,right=2cm,top=2cm,bottom=2cm"
-output: pdf_document
-"""
-                )
-
-        # add headers, disable floats to keep screenshots near next
-        f.write(r"""header-includes: |
-    \usepackage{fancyhdr}
-    \pagestyle{fancy}
-    \fancyhead[CO,CE]{Made with github.com/cwpearson/talk2pdf}
-    \fancyfoot[CO,CE]{Made with github.com/cwpearson/talk2pdf}
-    \fancyfoot[LE,RO]{\thepage}
-    \usepackage{float}
-    \let\origfigure\figure
-    \let\endorigfigure\endfigure
-    \renewenvironment{figure}[1][2] {
-        \expandafter\origfigure\expandafter[H]
-    } {
-        \endorigfigure
-    }
----
-""")
-
-        for block in blocks_with_images:
-
-            if block.when is None:
-                caption = ""
-            else:
-                hh, ss = divmod(block.when, 3600)
-                mm, ss = divmod(ss, 60)
-                hh = int(hh)
-                mm = int(mm)
-                ss = int(ss)
-                caption = f"[{hh}h{mm}m{ss}s]({url}&t={hh}h{mm}m{ss}s)"
-
-            if frame_path is not None:
-                f.write(r"""```{=latex}
-\begin{center}
-```
-""")
-                f.write(f'![{caption}]({frame_path})')
-                f.write(r"{width=50% margin=auto}")
-                f.write(r"""
-```{=latex}
-\end{center}
-```
-""")
-                f.write("\n\n")
-            f.write(block.text)
-            f.write("\n\n")
-
-    # cmd = ['pandoc', '-f', 'markdown-implicit_figures',
-    #        '-i', md_path, '-o', pdf_path]
-    cmd = ['pandoc', '-f', 'markdown',
-           '-i', md_path, '-o', pdf_path]
-    utils.eprint(f'==== {" ".join(map(str, cmd))}')
-    subprocess.run(cmd)
-
-    utils.eprint(f"==== wrote to {pdf_path}")
-
-
-def _do_youtube(url):
-    title = ytdlp.get_title(url)
+    plan.write_run_manifest(video_path, video_digest, noise_paths,
+                            clean_digests, frame_paths, len(blocks_with_images))
+
+    renderer = config.get(config.KEY_RENDERER)
+    with plan.Timer() as timer:
+        output_path = render.render(blocks_with_images, title, url, renderer,
+                                    config.get(config.KEY_IMAGE_DPI),
+                                    config.get(config.KEY_CACHE_DIR), video_digest)
+    plan.record(f"{plan.STAGE_RENDER}:{renderer}",
+                len(blocks_with_images), timer.elapsed)
+
+    utils.eprint(f"==== wrote to {output_path}")
+    t2p_openai.report_metrics()
+    return output_path
+
+
+def _do_youtube(url, title, at_sandia):
+    if not title:
+        title = ytdlp.get_title(url)
     utils.eprint(f"==== title is {title}")
 
     cache_dir = config.get(config.KEY_CACHE_DIR)
     utils.eprint(f"==== ensure {cache_dir}")
     cache_dir.mkdir(parents=True, exist_ok=True)
 
-    video_path = ytdlp.download(url, cache_dir)
-    _do_video_file(video_path, title, utils.at_sandia(), url=url)
+    # don't download the same talk twice at once
+    with utils.keyed_lock(url):
+        cached = ytdlp.find_download(url, cache_dir) is not None
+        with plan.Timer() as timer:
+            video_path = ytdlp.download(url, cache_dir)
+        if not cached:
+            plan.record(plan.STAGE_DOWNLOAD,
+                        t2p_ffmpeg.video_duration(video_path), timer.elapsed)
+    return _do_video_file(video_path, title, at_sandia, url=url)
+
+
+def _do_uri(uri, title, at_sandia):
+    if "youtube.com/watch" in uri:
+        return _do_youtube(uri, title, at_sandia)
+    elif Path(uri).is_file():
+        if not title:
+            title = f'talk2pdf transcription of {uri}'
+        return _do_video_file(Path(uri), title, at_sandia)
+    else:
+        raise RuntimeError("expected Youtube URL or video file path")
+
+
+def _work(args):
+    queue_path = config.get(config.KEY_WORK_QUEUE)
+    if queue_path is None:
+        utils.eprint("work needs --queue or TALK2PDF_WORK_QUEUE")
+        sys.exit(1)
+    queue = workqueue.WorkQueue(queue_path)
+    workqueue.work(queue, _work_handlers(utils.at_sandia()),
+                   exit_when_idle=args.exit_when_idle)
+
+
+def _serve(args):
+    # probe everything once and keep models and clients warm across jobs
+    at_sandia = utils.at_sandia()
+    method = config.get(config.KEY_TRANSCRIBE)
+    if method == config.TRANSCRIBE_OPENAI_WHISPER:
+        workers = config.get(config.KEY_WHISPER_WORKERS)
+        if workers > 1:
+            t2p_whisper.ensure_workers(workers)
+        else:
+            t2p_whisper.ensure_model()
+    if at_sandia:
+        t2p_openai.set_ca_bundle(utils.sandia_ca_bundle())
+    t2p_openai.get_client()
+
+    def run_job(uri, title):
+        return _do_uri(uri, title, at_sandia)
+
+    serve.serve(run_job, args.host, args.port, args.workers,
+                args.max_queued, args.max_history)
 
 
 if __name__ == "__main__":
@@ -376,12 +400,44 @@ if __name__ == "__main__":
         epilog="By Carl Pearson -- https://github.com/cwpearson/talk2pdf"
     )
 
-    parser.add_argument('URI', help="A video file or URL")
+    parser.add_argument(
+        'URI', help="A video file or URL, \"serve\" to run as a local service, or \"work\" to take chunks from --queue")
     parser.add_argument(
         '-t', '--title', help="The title to use in the output PDF")
+    parser.add_argument('--renderer', choices=[config.RENDERER_PANDOC, config.RENDERER_HTML],
+                        help="pandoc: PDF through LaTeX (default), html: self-contained HTML without LaTeX")
+    parser.add_argument('--dpi', type=int,
+                        help=f"resolution of embedded frames (default {config.DEFAULT_IMAGE_DPI})")
+    parser.add_argument('--whisper-workers', type=int,
+                        help="transcribe with local whisper on overlapping windows across this many processes")
+    parser.add_argument('--plan', action='store_true',
+                        help="print the predicted work and time as JSON without doing it")
+    parser.add_argument('--queue', type=Path,
+                        help="SQLite work queue on storage shared with workers; chunks are transcribed and cleaned by \"work\" processes")
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help="work: stop once the queue has nothing left to claim and no coordinator has a job in progress. "
+                        f"Waits up to {workqueue.DEFAULT_IDLE_GRACE_S}s for a first job; a coordinator that dies keeps workers for up to {workqueue.DEFAULT_LEASE_S}s")
+    parser.add_argument('--host', default="127.0.0.1",
+                        help="serve: address to listen on")
+    parser.add_argument('--port', type=int, default=8080,
+                        help="serve: port to listen on")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="serve: number of jobs to run at once")
+    parser.add_argument('--max-queued', type=int, default=100,
+                        help="serve: reject submissions beyond this many waiting jobs")
+    parser.add_argument('--max-history', type=int, default=serve.DEFAULT_MAX_HISTORY,
+                        help="serve: forget the oldest finished jobs beyond this many")
 
     args = parser.parse_args()
     config.load()
+    if args.renderer:
+        config.override(config.KEY_RENDERER, args.renderer)
+    if args.dpi:
+        config.override(config.KEY_IMAGE_DPI, args.dpi)
+    if args.queue:
+        config.override(config.KEY_WORK_QUEUE, args.queue)
+    if args.whisper_workers:
+        config.override(config.KEY_WHISPER_WORKERS, args.whisper_workers)
 
     if not config.config_file().is_file():
         utils.eprint(f"==== writing default config to {config.config_file()}")
@@ -389,14 +445,18 @@ if __name__ == "__main__":
         with open(config.config_file(), 'w') as f:
             f.write(json.dumps(config.default_config()))
 
-    if not args.title:
-        title = f'talk2pdf transcription of {args.URI}'
-    else:
-        title = args.title
-
-    if "youtube.com/watch" in args.URI:
-        _do_youtube(args.URI)
-    elif Path(args.URL).is_file():
-        _do_video_file(Path(args.URI), title, utils.at_sandia())
-    else:
+    if args.URI == "serve":
+        _serve(args)
+    elif args.URI == "work":
+        _work(args)
+    elif not ("youtube.com/watch" in args.URI or Path(args.URI).is_file()):
         utils.eprint("expected Youtube URL or video file path")
+        sys.exit(1)
+    elif args.plan:
+        try:
+            print(json.dumps(plan.plan_uri(args.URI), indent=2))
+        except RuntimeError as e:
+            utils.eprint(e)
+            sys.exit(1)
+    else:
+        _do_uri(args.URI, args.title, utils.at_sandia())
@@ -0,0 +1,93 @@
+import difflib
+from collections import namedtuple
+
+import talk2pdf.utils as utils
+
+Block = namedtuple("Block", ["text", "when", "image_path"])
+
+
+def combine_segments(segments, max_length):
+    chunk = ""
+    chunks = []
+    for seg in segments:
+        if len(chunk) + len(seg["text"]) < max_length:
+            chunk += seg["text"]
+        else:  # save chunk and start a new one
+            chunks += [chunk.strip()]
+            chunk = ""
+    if chunk != "":
+        chunks += [chunk.strip()]
+    return chunks
+
+
+# returns blocks with a start time from segments, or None for blocks whose
+# beginning doesn't match any segment
+def align_blocks(blocks, segments):
+    # Find a timestamp for the beginning of each paragraph
+    # Do this by comparing the beginning of the paragraph to each segment
+    # When we find the matching segment, we have a timestamp for the beginning of the paragraph
+    later_than = -1
+    blocks_with_starts = []
+    for block in blocks:
+
+        # find the first segment after no_earlier_than which matches the paragraph
+        found = False
+        for seg in segments:
+            if seg["start"] < later_than:
+                continue
+
+            # compare the beginning of p and seg["text"],
+            # consider seg["text"] to be the beginning of p if the match is close
+
+            s = difflib.SequenceMatcher(
+                lambda c: 0, block.text[:len(seg["text"])], seg["text"])
+            if s.ratio() > 0.8:
+                when = float(seg["start"])
+                later_than = when
+                utils.eprint(
+                    f'======== matched "{block.text[:25]}... to {seg["text"][:25]}..." at {when:.2f}s (score={s.ratio():.2f})')
+                blocks_with_starts += [Block(block.text, when, None)]
+                found = True
+                break
+
+        if not found:
+            # couldn't find a timestamp for this paragraph
+            blocks_with_starts += [Block(block.text, None, None)]
+            utils.eprint(
+                f"======== WARN: couldn't find any segments in {block.text}!")
+    return blocks_with_starts
+
+
+# give each block a frame from frame_for(when), unless is_same says it shows
+# the same thing as the most recent frame. Returns the blocks and every frame
+# that was looked at
+def select_frames(blocks, frame_for, is_same=utils.is_same_image):
+    blocks_with_images = []
+    frame_paths = []
+    recent_frame_path = None
+    for bi, block in enumerate(blocks):
+
+        # This block has a time, so extract an image
+        if block.when is not None:
+            frame_path = frame_for(block.when)
+            frame_paths += [frame_path]
+
+            # only include this image if it's different enough from
+            # an image in a previous block, or it's the first block
+            if recent_frame_path is None:
+                blocks_with_images += [Block(block.text,
+                                             block.when, frame_path)]
+                recent_frame_path = frame_path
+            elif not is_same(frame_path, recent_frame_path):
+                blocks_with_images += [
+                    Block(block.text, block.when, frame_path)]
+                recent_frame_path = frame_path
+                utils.eprint(
+                    f"==== image for block {bi} is new")
+            else:
+                # no image to include, it's the same as the most recent image
+                blocks_with_images += [block]
+        else:
+            # don't know when this block is, can't add an image
+            blocks_with_images += [block]
+    return blocks_with_images, frame_paths
@@ -0,0 +1,174 @@
+import json
+import mmap
+import struct
+import zlib
+from array import array
+from collections.abc import Sequence
+
+import talk2pdf.config as config
+import talk2pdf.utils as utils
+
+# transcript file layout (little-endian):
+#   header:  magic, segment count, text blob size
+#   starts:  count float64 segment start times
+#   offsets: count+1 uint32 offsets of each segment's text in the blob
+#   blob:    utf-8 text of all segments, back to back
+_TRANSCRIPT_MAGIC = b"T2P1"
+_TRANSCRIPT_HEADER = struct.Struct("<4sII")
+_TRANSCRIPT_SUFFIX = ".seg"
+
+_RESPONSE_SUFFIX = ".chat"
+
+
+def _path(digest, suffix):
+    return config.get(config.KEY_CACHE_DIR) / f"{digest}{suffix}"
+
+
+def _legacy_path(digest):
+    return config.get(config.KEY_CACHE_DIR) / f"{digest}.json"
+
+
+# read-only view of the segments in a memory-mapped transcript file
+class Segments(Sequence):
+
+    def __init__(self, buf):
+        magic, n, blob_size = _TRANSCRIPT_HEADER.unpack_from(buf, 0)
+        if magic != _TRANSCRIPT_MAGIC:
+            raise RuntimeError("not a talk2pdf transcript")
+        self._buf = buf
+        self._n = n
+        self._starts = _TRANSCRIPT_HEADER.size
+        self._offsets = self._starts + 8 * n
+        self._blob = self._offsets + 4 * (n + 1)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if i < 0 or i >= self._n:
+            raise IndexError("segment index out of range")
+        start, = struct.unpack_from("<d", self._buf, self._starts + 8 * i)
+        lo, hi = struct.unpack_from("<II", self._buf, self._offsets + 4 * i)
+        text = bytes(self._buf[self._blob + lo:self._blob + hi]).decode('utf-8')
+        return {"text": text, "start": start}
+
+
+def _write_transcript(path, transcript):
+    starts = array('d')
+    offsets = array('I', [0])
+    blob = bytearray()
+    for seg in transcript["segments"]:
+        starts.append(float(seg["start"]))
+        blob += seg["text"].encode('utf-8')
+        offsets.append(len(blob))
+    if starts.itemsize != 8 or offsets.itemsize != 4:
+        raise RuntimeError("unexpected array item size")
+
+    tmp_path = utils.tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(_TRANSCRIPT_HEADER.pack(
+            _TRANSCRIPT_MAGIC, len(starts), len(blob)))
+        f.write(starts.tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+    tmp_path.replace(path)
+
+
+def _read_transcript(path):
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return {"segments": Segments(buf)}
+
+
+# the parsed old-style .json entry at legacy_path, or None if there is none.
+# another process may migrate and remove it at any moment
+def _read_legacy(legacy_path):
+    try:
+        with open(legacy_path, 'r') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+# keep only the segment text and start times the pipeline consumes
+def store_transcript(digest, transcript):
+    path = _path(digest, _TRANSCRIPT_SUFFIX)
+    utils.eprint(f"==== caching transcript @ {path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_transcript(path, transcript)
+    return _read_transcript(path)
+
+
+# returns the cached transcript for digest, or None
+# an old-style .json entry is converted to the compact format and removed
+def load_transcript(digest):
+    path = _path(digest, _TRANSCRIPT_SUFFIX)
+    if path.is_file():
+        utils.eprint(f"==== reading cached {path}")
+        return _read_transcript(path)
+
+    legacy_path = _legacy_path(digest)
+    transcript = _read_legacy(legacy_path)
+    if transcript is not None:
+        utils.eprint(f"==== migrating {legacy_path} to {path}")
+        transcript = store_transcript(digest, transcript)
+        legacy_path.unlink(missing_ok=True)
+        return transcript
+
+    # someone else may have migrated it since we looked
+    if path.is_file():
+        return _read_transcript(path)
+    return None
+
+
+def has_transcript(digest):
+    return _path(digest, _TRANSCRIPT_SUFFIX).is_file() or _legacy_path(digest).is_file()
+
+
+# keep only the message content and token count of a chat response
+def store_response(digest, content, total_tokens):
+    path = _path(digest, _RESPONSE_SUFFIX)
+    utils.eprint(f"==== caching response @ {path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    raw = json.dumps({"content": content, "total_tokens": total_tokens})
+    tmp_path = utils.tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(raw.encode('utf-8'), 9))
+    tmp_path.replace(path)
+
+
+def _read_response(path):
+    with open(path, 'rb') as f:
+        return json.loads(zlib.decompress(f.read()).decode('utf-8'))
+
+
+# returns the cached {"content", "total_tokens"} for digest, or None
+# an old-style .json entry is converted to the compact format and removed
+def load_response(digest):
+    path = _path(digest, _RESPONSE_SUFFIX)
+    if path.is_file():
+        utils.eprint(f"==== retrieving cached response from {path}")
+        return _read_response(path)
+
+    legacy_path = _legacy_path(digest)
+    response = _read_legacy(legacy_path)
+    if response is not None:
+        utils.eprint(f"==== migrating {legacy_path} to {path}")
+        content = response['choices'][0]['message']['content']
+        total_tokens = int(response['usage']['total_tokens'])
+        store_response(digest, content, total_tokens)
+        legacy_path.unlink(missing_ok=True)
+        return {"content": content, "total_tokens": total_tokens}
+
+    # someone else may have migrated it since we looked
+    if path.is_file():
+        return _read_response(path)
+    return None
+
+
+def has_response(digest):
+    return _path(digest, _RESPONSE_SUFFIX).is_file() or _legacy_path(digest).is_file()
@@ -0,0 +1,177 @@
+import contextlib
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import talk2pdf.utils as utils
+
+# statuses worth another attempt: throttling and server-side trouble
+_RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_CONNECT_TIMEOUT_S = 10
+
+
+class APIError(RuntimeError):
+    def __init__(self, endpoint, status, body):
+        super().__init__(f"{endpoint} failed with HTTP {status}: {body[:200]}")
+        self.status = status
+        self.body = body
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    # block until a token is available, or raise if that would pass deadline
+    def acquire(self, deadline):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                raise DeadlineExceeded("rate limit wait would pass deadline")
+            time.sleep(wait)
+
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, latency, ok, retried):
+        with self._lock:
+            m = self._endpoints.setdefault(endpoint, {
+                "requests": 0, "errors": 0, "retries": 0,
+                "latency_total": 0.0, "latency_max": 0.0,
+            })
+            m["requests"] += 1
+            if not ok:
+                m["errors"] += 1
+            if retried:
+                m["retries"] += 1
+            m["latency_total"] += latency
+            m["latency_max"] = max(m["latency_max"], latency)
+
+    def snapshot(self):
+        with self._lock:
+            return {k: dict(v) for k, v in self._endpoints.items()}
+
+    def report(self):
+        for endpoint, m in sorted(self.snapshot().items()):
+            mean = m["latency_total"] / m["requests"]
+            utils.eprint(
+                f"==== {endpoint}: {m['requests']} requests, {m['errors']} errors, "
+                f"{m['retries']} retries, latency mean {mean:.2f}s max {m['latency_max']:.2f}s")
+
+
+class Client(object):
+    def __init__(self, api_key, api_base, ca_bundle=None,
+                 pool_size=4, max_attempts=8, backoff_base=1.0, backoff_max=60.0,
+                 rate=2.0, burst=4):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate, burst)
+        self.metrics = Metrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        if ca_bundle is not None:
+            self.session.verify = str(ca_bundle)
+
+    # exponential backoff with full jitter
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    # POST to endpoint until it succeeds, runs out of attempts, or passes deadline_s.
+    # make_kwargs is called for each attempt so file bodies can be reopened
+    def _post(self, endpoint, deadline_s, make_kwargs):
+        deadline = time.monotonic() + deadline_s
+        url = f"{self.api_base}/{endpoint}"
+
+        for attempt in range(self.max_attempts):
+            self.bucket.acquire(deadline)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{endpoint} passed its deadline")
+
+            retry_after = None
+            start = time.monotonic()
+            try:
+                with make_kwargs() as kwargs:
+                    resp = self.session.post(
+                        url, timeout=(min(_CONNECT_TIMEOUT_S, remaining), remaining), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.record(endpoint, time.monotonic() - start,
+                                    ok=False, retried=attempt > 0)
+                utils.eprint(f"==== {endpoint} attempt {attempt}: {e}")
+                error = e
+            else:
+                self.metrics.record(endpoint, time.monotonic() - start,
+                                    ok=resp.ok, retried=attempt > 0)
+                if resp.ok:
+                    return resp.json()
+                error = APIError(endpoint, resp.status_code, resp.text)
+                if resp.status_code not in _RETRY_STATUS:
+                    raise error
+                utils.eprint(
+                    f"==== {endpoint} attempt {attempt}: HTTP {resp.status_code}")
+                try:
+                    retry_after = float(resp.headers.get("Retry-After", ""))
+                except ValueError:
+                    pass
+
+            if attempt + 1 == self.max_attempts:
+                break
+            wait = self._backoff(attempt)
+            if retry_after is not None:
+                wait = max(wait, retry_after)
+            if time.monotonic() + wait > deadline:
+                raise DeadlineExceeded(
+                    f"{endpoint} passed its deadline") from error
+            utils.eprint(f"==== retry {endpoint} in {wait:.2f}s")
+            time.sleep(wait)
+
+        raise error
+
+    def translate(self, path, model, response_format, deadline_s=900):
+        data = {"model": model, "response_format": response_format}
+
+        @contextlib.contextmanager
+        def upload():
+            with open(path, 'rb') as f:
+                yield {"data": data, "files": {"file": (path.name, f)}}
+
+        return self._post("audio/translations", deadline_s, upload)
+
+    def chat(self, model, messages, temperature, deadline_s=300):
+        body = {"model": model, "messages": messages,
+                "temperature": temperature}
+
+        @contextlib.contextmanager
+        def request():
+            yield {"json": body}
+
+        return self._post("chat/completions", deadline_s, request)
@@ -10,10 +10,24 @@ import talk2pdf.utils as utils
 KEY_TRANSCRIBE = "transcribe"
 KEY_OPENAI_SECRET = "openapi_secret"
 KEY_CACHE_DIR = "cache_dir"
+KEY_OPENAI_API_BASE = "openai_api_base"
+KEY_RENDERER = "renderer"
+KEY_IMAGE_DPI = "image_dpi"
+KEY_WORK_QUEUE = "work_queue"
+KEY_WHISPER_WORKERS = "whisper_workers"
 
 TRANSCRIBE_OPENAI_WHISPER = "openai_whisper"
 TRANSCRIBE_OPENAI = "openai"
 
+RENDERER_PANDOC = "pandoc"
+RENDERER_HTML = "html"
+
+DEFAULT_OPENAI_API_BASE = "https://api.openai.com/v1"
+DEFAULT_IMAGE_DPI = 150
+
+CHATGPT_MAX_STRING_LEN = 3000
+OPENAI_AUDIO_LIMIT_BYTES = 1024 * 1024 * 25
+
 
 class Config(object):
     def __init__(self, raw):
@@ -22,6 +36,9 @@ class Config(object):
     def __getitem__(self, k):
         return self.raw[k]
 
+    def __setitem__(self, k, v):
+        self.raw[k] = v
+
 
 _singleton = Config({})
 
@@ -56,6 +73,11 @@ def load():
     d[KEY_CACHE_DIR] = _cache_dir()
     d[KEY_OPENAI_SECRET] = _openapi_secret()
     d[KEY_TRANSCRIBE] = _transcribe()
+    d[KEY_OPENAI_API_BASE] = _openai_api_base()
+    d[KEY_RENDERER] = _renderer()
+    d[KEY_IMAGE_DPI] = _image_dpi()
+    d[KEY_WORK_QUEUE] = _work_queue()
+    d[KEY_WHISPER_WORKERS] = _whisper_workers()
     global _singleton
     _singleton = Config(d)
 
@@ -72,6 +94,36 @@ def _openapi_secret():
         sys.exit(1)
 
 
+def _openai_api_base():
+    if "OPENAI_API_BASE" in os.environ:
+        return os.environ["OPENAI_API_BASE"]
+    with open(config_file(), 'r') as f:
+        return json.loads(f.read()).get(KEY_OPENAI_API_BASE, DEFAULT_OPENAI_API_BASE)
+
+
+def _renderer():
+    with open(config_file(), 'r') as f:
+        return json.loads(f.read()).get(KEY_RENDERER, RENDERER_PANDOC)
+
+
+def _image_dpi():
+    with open(config_file(), 'r') as f:
+        return int(json.loads(f.read()).get(KEY_IMAGE_DPI, DEFAULT_IMAGE_DPI))
+
+
+def _whisper_workers():
+    if "TALK2PDF_WHISPER_WORKERS" in os.environ:
+        return int(os.environ["TALK2PDF_WHISPER_WORKERS"])
+    with open(config_file(), 'r') as f:
+        return int(json.loads(f.read()).get(KEY_WHISPER_WORKERS, 1))
+
+
+def _work_queue():
+    if "TALK2PDF_WORK_QUEUE" in os.environ:
+        return Path(os.environ["TALK2PDF_WORK_QUEUE"])
+    return None
+
+
 def _cache_dir():
     if "TALK2PDF_CACHE_DIR" in os.environ:
         return Path(os.environ["TALK2PDF_CACHE_DIR"])
@@ -105,3 +157,8 @@ def cache_dir_size():
 
 def get(k):
     return _singleton[k]
+
+
+# override a loaded value, e.g. from a command line flag
+def override(k, v):
+    _singleton[k] = v
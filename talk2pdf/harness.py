@@ -0,0 +1,305 @@
+# Accuracy-versus-speed harness for paragraph alignment, transcript chunking
+# and frame selection.
+#
+#   python -m talk2pdf.harness --output baseline.json
+#   ... change the engine ...
+#   python -m talk2pdf.harness --output new.json --baseline baseline.json
+#
+# Every fixture is generated from a fixed seed, so runs are comparable across
+# machines and commits. With --baseline, exits non-zero if any quality metric
+# is worse than the baseline (or runtime, with --max-slowdown).
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+import talk2pdf.align as align
+import talk2pdf.config as config
+
+# synthetic talks with known paragraph starts. edit_rate is the fraction of
+# words the "cleaner" changes, like punctuation and capitalization fixes.
+# The cleaner starts paragraphs where whisper starts segments; the
+# mid-segment fixture starts them at arbitrary words instead, which the
+# current engine cannot match, to measure engines that can
+TRANSCRIPT_FIXTURES = [
+    {"name": "transcript-short", "seed": 1, "words": 800,
+        "edit_rate": 0.0, "mid_segment": False},
+    {"name": "transcript-long", "seed": 2, "words": 12000,
+        "edit_rate": 0.0, "mid_segment": False},
+    {"name": "transcript-edited", "seed": 3, "words": 3000,
+        "edit_rate": 0.03, "mid_segment": False},
+    {"name": "transcript-heavily-edited", "seed": 4, "words": 3000,
+        "edit_rate": 0.10, "mid_segment": False},
+    {"name": "transcript-mid-segment-starts", "seed": 8, "words": 3000,
+        "edit_rate": 0.0, "mid_segment": True},
+]
+
+# synthetic slide decks with known slide changes. motion is how far the
+# presenter moves between frames, builds adds one bullet per slide instead
+# of drawing a new slide
+FRAME_FIXTURES = [
+    {"name": "frames-static", "seed": 5, "slides": 12,
+        "frames_per_slide": 4, "motion": 0, "builds": False},
+    {"name": "frames-presenter-motion", "seed": 6, "slides": 12,
+        "frames_per_slide": 4, "motion": 6, "builds": False},
+    {"name": "frames-slide-builds", "seed": 7, "slides": 12,
+        "frames_per_slide": 3, "motion": 2, "builds": True},
+]
+
+# +1 if larger is better, -1 if smaller is better, and how much worse than
+# the baseline counts as a regression
+QUALITY_METRICS = {
+    "timestamp_error_mean_s": (-1, 0.05),
+    "timestamp_error_max_s": (-1, 0.5),
+    "unmatched_ratio": (-1, 0.0),
+    "dropped_text_ratio": (-1, 0.0),
+    "frame_precision": (1, 0.0),
+    "frame_recall": (1, 0.0),
+}
+RUNTIME_METRICS = ["align_s", "combine_s", "select_frames_s"]
+
+
+def _timed(repeat, f):
+    best = None
+    for _ in range(repeat):
+        # keep the engines' progress output out of the report
+        with contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            result = f()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _make_talk(rng, n_words, edit_rate, mid_segment):
+    vocab = ["".join(rng.choice(string.ascii_lowercase)
+                     for _ in range(rng.randint(2, 9))) for _ in range(400)]
+    words = [rng.choice(vocab) for _ in range(n_words)]
+
+    # whisper-like segments of a few seconds each
+    times = []
+    segments = []
+    seg_words = []
+    t = 0.0
+    i = 0
+    while i < len(words):
+        n = rng.randint(6, 16)
+        seg_start = t
+        seg_words += [i]
+        for _ in words[i:i + n]:
+            times += [t]
+            t += rng.uniform(0.25, 0.45)
+        segments += [{"text": " " + " ".join(words[i:i + n]),
+                      "start": round(seg_start, 2)}]
+        t += rng.uniform(0.0, 1.5)
+        i += n
+
+    # paragraphs of 40 to 150 words, starting at a segment or any word
+    candidates = range(len(words)) if mid_segment else seg_words
+    starts = [0]
+    while True:
+        at_least = starts[-1] + rng.randint(40, 150)
+        later = [c for c in candidates if c >= at_least]
+        if not later:
+            break
+        starts += [later[0]]
+
+    blocks = []
+    truth = []
+    for lo, hi in zip(starts, starts[1:] + [len(words)]):
+        para = []
+        for w in words[lo:hi]:
+            if rng.random() < edit_rate:
+                w = rng.choice([w.capitalize(), w + ",", w[:-1] or w])
+            para += [w]
+        text = " ".join(para)
+        blocks += [align.Block(text[0].upper() + text[1:] + ".", None, None)]
+        truth += [times[lo]]
+    return segments, blocks, truth, len(words)
+
+
+def run_transcript_fixture(fixture, repeat):
+    rng = random.Random(fixture["seed"])
+    segments, blocks, truth, n_words = _make_talk(
+        rng, fixture["words"], fixture["edit_rate"], fixture["mid_segment"])
+
+    aligned, align_s = _timed(
+        repeat, lambda: align.align_blocks(blocks, segments))
+    errors = [abs(b.when - t) for b, t in zip(aligned, truth)
+              if b.when is not None]
+    unmatched = sum(1 for b in aligned if b.when is None)
+
+    chunks, combine_s = _timed(repeat, lambda: align.combine_segments(
+        segments, config.CHATGPT_MAX_STRING_LEN))
+    kept_words = sum(len(c.split()) for c in chunks)
+
+    return {
+        "blocks": len(blocks),
+        "timestamp_error_mean_s": sum(errors) / len(errors) if errors else None,
+        "timestamp_error_max_s": max(errors) if errors else None,
+        "unmatched_ratio": unmatched / len(blocks),
+        "dropped_text_ratio": 1 - kept_words / n_words,
+        "align_s": align_s,
+        "combine_s": combine_s,
+    }
+
+
+def _draw_slide(bars):
+    img = Image.new("RGB", (480, 270), "white")
+    d = ImageDraw.Draw(img)
+    d.rectangle([0, 0, 480, 36], fill=bars["color"])
+    for x, y, w in bars["lines"]:
+        d.rectangle([x, y, x + w, y + 8], fill=(60, 60, 60))
+    return img
+
+
+def _new_slide(rng):
+    color = tuple(rng.randint(0, 200) for _ in range(3))
+    return {"color": color, "lines": [(rng.randint(20, 60), 50 + 22 * i, rng.randint(120, 380))
+                                      for i in range(rng.randint(3, 8))]}
+
+
+def _make_deck(rng, fixture, out_dir):
+    paths = []
+    truth = []
+    slide = _new_slide(rng)
+    slide["lines"] = slide["lines"][:2]
+    for si in range(fixture["slides"]):
+        if si > 0:
+            if fixture["builds"]:
+                y = 50 + 22 * len(slide["lines"])
+                slide = dict(slide, lines=slide["lines"] +
+                             [(rng.randint(20, 60), y, rng.randint(120, 380))])
+            else:
+                slide = _new_slide(rng)
+        base = _draw_slide(slide)
+        for fi in range(fixture["frames_per_slide"]):
+            # the presenter, standing in the corner and moving a little
+            img = base.copy()
+            dx = rng.randint(-fixture["motion"], fixture["motion"])
+            dy = rng.randint(-fixture["motion"], fixture["motion"])
+            ImageDraw.Draw(img).ellipse(
+                [420 + dx, 190 + dy, 460 + dx, 260 + dy], fill=(150, 110, 90))
+            path = out_dir / f"{fixture['name']}-{len(paths)}.jpg"
+            img.save(path, quality=85)
+            paths += [path]
+            truth += [fi == 0]
+    return paths, truth
+
+
+def run_frame_fixture(fixture, repeat, work_dir):
+    rng = random.Random(fixture["seed"])
+    paths, truth = _make_deck(rng, fixture, work_dir)
+    blocks = [align.Block(f"block {i}", float(i), None)
+              for i in range(len(paths))]
+
+    (selected, _), select_s = _timed(repeat, lambda: align.select_frames(
+        blocks, lambda when: paths[int(when)]))
+    predicted = [b.image_path is not None for b in selected]
+
+    tp = sum(1 for p, t in zip(predicted, truth) if p and t)
+    fp = sum(1 for p, t in zip(predicted, truth) if p and not t)
+    fn = sum(1 for p, t in zip(predicted, truth) if t and not p)
+    return {
+        "frames": len(paths),
+        "slide_changes": sum(truth),
+        "frame_precision": tp / (tp + fp) if tp + fp else 1.0,
+        "frame_recall": tp / (tp + fn) if tp + fn else 1.0,
+        "select_frames_s": select_s,
+    }
+
+
+def run(repeat):
+    results = {}
+    for fixture in TRANSCRIPT_FIXTURES:
+        results[fixture["name"]] = run_transcript_fixture(fixture, repeat)
+    with tempfile.TemporaryDirectory() as d:
+        for fixture in FRAME_FIXTURES:
+            results[fixture["name"]] = run_frame_fixture(
+                fixture, repeat, Path(d))
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "fixtures": results,
+    }
+
+
+# list of (fixture, metric, baseline, current, verdict) rows
+def compare(baseline, current, max_slowdown=None):
+    rows = []
+    for name, metrics in current["fixtures"].items():
+        base = baseline["fixtures"].get(name)
+        if base is None:
+            continue
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if old is None or value is None:
+                continue
+            verdict = ""
+            if metric in QUALITY_METRICS:
+                sign, tolerance = QUALITY_METRICS[metric]
+                if (old - value) * sign > tolerance:
+                    verdict = "WORSE"
+                elif (value - old) * sign > tolerance:
+                    verdict = "better"
+            elif metric in RUNTIME_METRICS and old > 0:
+                ratio = value / old
+                verdict = f"{ratio:.2f}x"
+                if max_slowdown is not None and ratio > max_slowdown:
+                    verdict += " SLOWER"
+            rows += [(name, metric, old, value, verdict)]
+    return rows
+
+
+def _fmt(v):
+    return f"{v:.4g}" if isinstance(v, float) else str(v)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m talk2pdf.harness",
+        description="Score alignment and frame selection on synthetic fixtures")
+    parser.add_argument('--output', type=Path,
+                        help="write results as JSON to this file")
+    parser.add_argument('--baseline', type=Path,
+                        help="compare against results from an earlier run")
+    parser.add_argument('--max-slowdown', type=float,
+                        help="fail if any runtime grows by more than this factor")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="report the best of this many timings")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+
+    if args.baseline is None:
+        for name, metrics in results["fixtures"].items():
+            print(name)
+            for metric, value in metrics.items():
+                print(f"    {metric:24s} {_fmt(value)}")
+        sys.exit(0)
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.loads(f.read())
+    rows = compare(baseline, results, args.max_slowdown)
+    print(f"{'fixture':28s} {'metric':24s} {'baseline':>10s} {'current':>10s}")
+    for name, metric, old, value, verdict in rows:
+        print(f"{name:28s} {metric:24s} {_fmt(old):>10s} {_fmt(value):>10s}  {verdict}")
+    failed = [r for r in rows if "WORSE" in r[4] or "SLOWER" in r[4]]
+    if failed:
+        print(f"{len(failed)} regressions against {args.baseline}")
+        sys.exit(1)
@@ -0,0 +1,254 @@
+import fcntl
+import hashlib
+import json
+import math
+import time
+from pathlib import Path
+
+import talk2pdf.cache as cache
+import talk2pdf.config as config
+import talk2pdf.t2p_ffmpeg as t2p_ffmpeg
+import talk2pdf.t2p_openai as t2p_openai
+import talk2pdf.t2p_whisper as t2p_whisper
+import talk2pdf.utils as utils
+import talk2pdf.ytdlp as ytdlp
+
+# used to estimate a talk that has never been processed
+MP3_BYTES_PER_SECOND = 128000 / 8  # ffmpeg's default mp3 bitrate
+SPEECH_CHARS_PER_SECOND = 15
+PARAGRAPHS_PER_CHAT_CALL = 5
+
+STAGE_DOWNLOAD = "download"
+STAGE_EXTRACT_AUDIO = "extract_audio"
+STAGE_SPLIT = "split"
+STAGE_TRANSCRIBE = "transcribe"
+STAGE_CLEAN = "clean"
+STAGE_FRAMES = "frames"
+STAGE_RENDER = "render"
+
+# seconds per unit of work for each stage, until a run on this machine says otherwise
+_DEFAULT_SECONDS_PER_UNIT = {
+    STAGE_DOWNLOAD: 0.05,  # per second of video
+    STAGE_EXTRACT_AUDIO: 0.02,  # per second of video
+    STAGE_SPLIT: 0.01,  # per second of audio
+    f"{STAGE_TRANSCRIBE}:{config.TRANSCRIBE_OPENAI}": 1.0 / (1024 * 1024),  # per byte
+    f"{STAGE_TRANSCRIBE}:{config.TRANSCRIBE_OPENAI_WHISPER}": 20.0 / (1024 * 1024),
+    STAGE_CLEAN: 20.0,  # per chat call
+    STAGE_FRAMES: 0.5,  # per extracted frame
+    f"{STAGE_RENDER}:{config.RENDERER_PANDOC}": 0.1,  # per block
+    f"{STAGE_RENDER}:{config.RENDERER_HTML}": 0.01,
+}
+
+# how many recent runs a timing average covers
+_HISTORY_WINDOW = 10
+
+
+def _timings_path():
+    return config.get(config.KEY_CACHE_DIR) / "timings.json"
+
+
+# history is only used for estimates, so an unreadable file is no history
+def _load_timings():
+    try:
+        with open(_timings_path(), 'r') as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+
+# note that a stage did units of work in seconds, for future estimates.
+# serve jobs and queue workers record concurrently, so updates are made
+# under a lock file and land atomically
+def record(stage, units, seconds):
+    if units <= 0:
+        return
+    path = _timings_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        timings = _load_timings()
+        t = timings.setdefault(stage, {"seconds_per_unit": 0.0, "samples": 0})
+        t["samples"] += 1
+        t["seconds_per_unit"] += (seconds / units -
+                                  t["seconds_per_unit"]) / min(t["samples"], _HISTORY_WINDOW)
+        tmp = utils.tmp_path(path)
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(timings))
+        tmp.replace(path)
+
+
+class Timer(object):
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.monotonic() - self.start
+
+
+def _run_manifest_path(video_digest):
+    return config.get(config.KEY_CACHE_DIR) / f"{video_digest}.run.json"
+
+
+# a cheap stand-in for the digest of video_path, from where it is, its size
+# and when it was modified
+def _video_key_path(video_path):
+    st = video_path.stat()
+    h = hashlib.md5(
+        f"{video_path.resolve()}\0{st.st_size}\0{st.st_mtime_ns}".encode('utf-8'))
+    return config.get(config.KEY_CACHE_DIR) / f"{h.hexdigest()}.video"
+
+
+# the digest of video_path, without reading it if a run already recorded it
+def _video_digest(video_path):
+    try:
+        with open(_video_key_path(video_path), 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return utils.hash_file(video_path)
+
+
+# what a run of the pipeline on video_digest produced, so later plans can
+# look up exactly which chunks, chat calls and frames are already cached
+def write_run_manifest(video_path, video_digest, chunk_paths, clean_digests, frame_paths, blocks):
+    with open(_run_manifest_path(video_digest), 'w') as f:
+        f.write(json.dumps({
+            "chunks": [str(p) for p in chunk_paths],
+            "clean_digests": clean_digests,
+            "frames": [str(p) for p in frame_paths],
+            "blocks": blocks,
+        }))
+    key_path = _video_key_path(video_path)
+    tmp = utils.tmp_path(key_path)
+    with open(tmp, 'w') as f:
+        f.write(video_digest)
+    tmp.replace(key_path)
+
+
+def _load_run_manifest(video_digest):
+    path = _run_manifest_path(video_digest)
+    if path.is_file():
+        with open(path, 'r') as f:
+            return json.loads(f.read())
+    return None
+
+
+def transcript_digest(path):
+    method = config.get(config.KEY_TRANSCRIBE)
+    if method == config.TRANSCRIBE_OPENAI_WHISPER:
+        return t2p_whisper.transcribe_digest(path)
+    elif method == config.TRANSCRIBE_OPENAI:
+        return t2p_openai.transcribe_digest(path)
+    else:
+        raise RuntimeError(f"unsupported transcribe method {method}")
+
+
+def _estimate(stages, timings):
+    for name, stage in stages.items():
+        key = name
+        if name == STAGE_TRANSCRIBE:
+            key = f"{name}:{config.get(config.KEY_TRANSCRIBE)}"
+        elif name == STAGE_RENDER:
+            key = f"{name}:{config.get(config.KEY_RENDERER)}"
+        if key in timings:
+            stage["seconds_per_unit"] = timings[key]["seconds_per_unit"]
+            stage["from_history"] = True
+        else:
+            stage["seconds_per_unit"] = _DEFAULT_SECONDS_PER_UNIT[key]
+            stage["from_history"] = False
+        stage["estimate_s"] = stage["units"] * stage["seconds_per_unit"]
+    return sum(stage["estimate_s"] for stage in stages.values())
+
+
+def _plan_stages(duration, video_path):
+    cache_dir = config.get(config.KEY_CACHE_DIR)
+    stages = {}
+
+    manifest = None
+    audio_cached = False
+    if video_path is not None:
+        video_digest = _video_digest(video_path)
+        audio_path = cache_dir / f"{video_digest}.mp3"
+        audio_cached = audio_path.is_file()
+        manifest = _load_run_manifest(video_digest)
+    stages[STAGE_EXTRACT_AUDIO] = {
+        "cached": audio_cached,
+        "units": 0 if audio_cached else duration,
+    }
+
+    if audio_cached:
+        audio_bytes = audio_path.stat().st_size
+    else:
+        audio_bytes = duration * MP3_BYTES_PER_SECOND
+    stages[STAGE_SPLIT] = {"units": duration}
+
+    if manifest is not None:
+        chunk_paths = [Path(p) for p in manifest["chunks"]]
+        chunks = len(chunk_paths)
+        uploads = [p for p in chunk_paths if not (
+            p.is_file() and cache.has_transcript(transcript_digest(p)))]
+        upload_bytes = sum(p.stat().st_size if p.is_file()
+                           else audio_bytes / chunks for p in uploads)
+        chat_calls = len(manifest["clean_digests"])
+        chat_misses = sum(1 for d in manifest["clean_digests"]
+                          if not cache.has_response(d))
+        frames = len(manifest["frames"])
+        frame_misses = sum(1 for p in manifest["frames"]
+                           if not Path(p).is_file())
+        blocks = manifest["blocks"]
+    else:
+        chunk_s = config.OPENAI_AUDIO_LIMIT_BYTES * 0.9 / (audio_bytes / duration)
+        chunks = math.ceil(duration / chunk_s)
+        uploads = [None] * chunks
+        upload_bytes = audio_bytes
+        chat_calls = math.ceil(duration * SPEECH_CHARS_PER_SECOND /
+                               config.CHATGPT_MAX_STRING_LEN)
+        chat_misses = chat_calls
+        frames = chat_calls * PARAGRAPHS_PER_CHAT_CALL
+        frame_misses = frames
+        blocks = frames
+
+    stages[STAGE_TRANSCRIBE] = {
+        "chunks": chunks,
+        "cached": chunks - len(uploads),
+        "uploads": len(uploads),
+        "upload_bytes": int(upload_bytes),
+        "units": int(upload_bytes),
+    }
+    stages[STAGE_CLEAN] = {
+        "chat_calls": chat_misses,
+        "cached": chat_calls - chat_misses,
+        "units": chat_misses,
+    }
+    stages[STAGE_FRAMES] = {
+        "frames": frame_misses,
+        "cached": frames - frame_misses,
+        "units": frame_misses,
+    }
+    stages[STAGE_RENDER] = {"blocks": blocks, "units": blocks}
+    return stages, manifest is not None
+
+
+# predict the work needed to convert uri without doing any of it
+def plan_uri(uri):
+    cache_dir = config.get(config.KEY_CACHE_DIR)
+    plan = {"uri": uri}
+
+    if "youtube.com/watch" in uri:
+        video_path = ytdlp.find_download(uri, cache_dir)
+        if video_path is None:
+            duration = ytdlp.get_duration(uri)
+        else:
+            duration = t2p_ffmpeg.video_duration(video_path)
+    else:
+        video_path = Path(uri)
+        duration = t2p_ffmpeg.video_duration(video_path)
+
+    plan["duration_s"] = duration
+    stages, plan["from_manifest"] = _plan_stages(duration, video_path)
+    if video_path is None:
+        stages = {STAGE_DOWNLOAD: {"units": duration}, **stages}
+
+    plan["estimate_s"] = _estimate(stages, _load_timings())
+    plan["stages"] = stages
+    return plan
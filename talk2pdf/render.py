@@ -0,0 +1,323 @@
+import base64
+import hashlib
+import html
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image
+
+import talk2pdf.config as config
+import talk2pdf.utils as utils
+
+TODAY_STRING = datetime.today().strftime('%b %d, %Y')
+
+# frames are shown at half the width of a page with 2cm margins
+IMAGE_WIDTH_INCHES = 3.5
+IMAGE_QUALITY = 80
+
+# bump whenever _markdown_block or _html_block changes what they produce, so
+# fragments rendered by the old code are not reused
+FRAGMENT_VERSION = 1
+
+
+def _timestamp(when):
+    hh, ss = divmod(when, 3600)
+    mm, ss = divmod(ss, 60)
+    return f"{int(hh)}h{int(mm)}m{int(ss)}s"
+
+
+def _prepare_image(src, output_dir, width_px):
+    dst = output_dir / f"{src.stem}-{width_px}px.jpg"
+    if dst.is_file():
+        return dst
+
+    with Image.open(src) as img:
+        # let the JPEG decoder downscale by a power of two before resampling
+        img.draft("RGB", (width_px, width_px * img.height // img.width))
+        img = img.convert("RGB")
+        if img.width > width_px:
+            img = img.resize(
+                (width_px, round(img.height * width_px / img.width)), Image.LANCZOS)
+        tmp = utils.tmp_path(dst)
+        img.save(tmp, "JPEG", quality=IMAGE_QUALITY,
+                 optimize=True, progressive=True)
+    tmp.replace(dst)
+    return dst
+
+
+# downscale and recompress frames in parallel so they are no larger than
+# needed at dpi. Returns a dict from each source path to its prepared path
+def prepare_images(paths, output_dir, dpi):
+    width_px = int(IMAGE_WIDTH_INCHES * dpi)
+    paths = sorted(set(paths))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        prepared = list(pool.map(
+            lambda p: _prepare_image(p, output_dir, width_px), paths))
+    return dict(zip(paths, prepared))
+
+
+def _markdown_header(title):
+    header = f"""---
+title: "{title}"
+author: talk2pdf (by Carl Pearson)
+date: {TODAY_STRING}
+geometry: "left=2cm,right=2cm,top=2cm,bottom=2cm"
+output: pdf_document
+"""
+
+    # add headers, disable floats to keep screenshots near next
+    header += r"""header-includes: |
+    \usepackage{fancyhdr}
+    \pagestyle{fancy}
+    \fancyhead[CO,CE]{Made with github.com/cwpearson/talk2pdf}
+    \fancyfoot[CO,CE]{Made with github.com/cwpearson/talk2pdf}
+    \fancyfoot[LE,RO]{\thepage}
+    \usepackage{float}
+    \let\origfigure\figure
+    \let\endorigfigure\endfigure
+    \renewenvironment{figure}[1][2] {
+        \expandafter\origfigure\expandafter[H]
+    } {
+        \endorigfigure
+    }
+---
+"""
+    return header
+
+
+def _markdown_block(block, url):
+    if block.when is None:
+        caption = ""
+    elif url is None:
+        caption = _timestamp(block.when)
+    else:
+        ts = _timestamp(block.when)
+        caption = f"[{ts}]({url}&t={ts})"
+
+    md = ""
+    if block.image_path is not None:
+        md += r"""```{=latex}
+\begin{center}
+```
+"""
+        md += f'![{caption}]({block.image_path})'
+        md += r"{width=50% margin=auto}"
+        md += r"""
+```{=latex}
+\end{center}
+```
+"""
+        md += "\n\n"
+    md += block.text
+    md += "\n\n"
+    return md
+
+
+def render_pandoc(md_path, pdf_path):
+    # cmd = ['pandoc', '-f', 'markdown-implicit_figures',
+    #        '-i', md_path, '-o', pdf_path]
+    cmd = ['pandoc', '-f', 'markdown',
+           '-i', md_path, '-o', pdf_path]
+    utils.eprint(f'==== {" ".join(map(str, cmd))}')
+    cp = subprocess.run(cmd)
+    if cp.returncode != 0:
+        raise RuntimeError(f"pandoc failed to render {pdf_path}")
+
+
+_HTML_HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 17cm; margin: 2cm auto; font-family: serif; line-height: 1.4; }}
+header, footer {{ text-align: center; }}
+figure {{ text-align: center; margin: 1em 0; break-inside: avoid; }}
+figure img {{ width: 50%; }}
+figcaption {{ font-size: smaller; }}
+</style>
+</head>
+<body>
+<header>
+<h1>{title}</h1>
+<p>talk2pdf (by Carl Pearson)<br>{date}</p>
+</header>
+"""
+
+_HTML_FOOT = """<footer><p>Made with github.com/cwpearson/talk2pdf</p></footer>
+</body>
+</html>
+"""
+
+
+def _html_block(block, url):
+    parts = []
+    if block.image_path is not None:
+        with open(block.image_path, 'rb') as f:
+            data = base64.b64encode(f.read()).decode('ascii')
+        parts += ['<figure>',
+                  f'<img alt="" src="data:image/jpeg;base64,{data}">']
+        if block.when is not None:
+            ts = _timestamp(block.when)
+            if url is None:
+                parts += [f'<figcaption>{ts}</figcaption>']
+            else:
+                href = html.escape(f"{url}&t={ts}")
+                parts += [f'<figcaption><a href="{href}">{ts}</a></figcaption>']
+        parts += ['</figure>']
+    parts += [f'<p>{html.escape(block.text)}</p>', '']
+    return "\n".join(parts)
+
+
+def _html_header(title):
+    return _HTML_HEAD.format(title=html.escape(title), date=TODAY_STRING)
+
+
+def _fingerprint(*parts):
+    h = hashlib.md5()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# identifies everything that goes into a block's rendered fragment.
+# prepared frame names are derived from the frame digest and width
+def _block_fingerprint(renderer, block, url):
+    if block.image_path is None:
+        frame = None
+    else:
+        st = block.image_path.stat()
+        frame = (block.image_path.name, st.st_size, st.st_mtime_ns)
+    return _fingerprint(FRAGMENT_VERSION, renderer, block.text, block.when, frame, url)
+
+
+# the rendered fragment for block, reused from fragment_dir when an earlier
+# render produced one with the same fingerprint
+def _fragment(fragment_dir, fingerprint, make):
+    path = fragment_dir / f"{fingerprint}.frag"
+    if path.is_file():
+        with open(path, 'r') as f:
+            return f.read(), False
+    text = make()
+    tmp = utils.tmp_path(path)
+    with open(tmp, 'w') as f:
+        f.write(text)
+    tmp.replace(path)
+    return text, True
+
+
+def _write_document(path, header, fragments, footer):
+    tmp = utils.tmp_path(path)
+    with open(tmp, 'w') as f:
+        f.write(header)
+        for fragment in fragments:
+            f.write(fragment)
+        f.write(footer)
+    tmp.replace(path)
+
+
+# remove fragments of this document that no renderer's last render used,
+# and any left in the shared directory by older versions
+def _prune_fragments(fragments_root, fragment_dir, manifest):
+    keep = {f"{fp}.frag" for e in manifest.values() for fp in e["blocks"]}
+    stale = [p for p in fragment_dir.glob("*.frag") if p.name not in keep]
+    stale += list(fragments_root.glob("*.frag"))
+    for path in stale:
+        path.unlink(missing_ok=True)
+    if stale:
+        utils.eprint(f"==== removed {len(stale)} unused block fragments")
+
+
+def _write_manifest(path, manifest):
+    tmp = utils.tmp_path(path)
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(manifest))
+    tmp.replace(path)
+
+
+# render blocks with a config.RENDERER_* to output_stem plus the
+# renderer's extension, after shrinking frames to dpi. Returns the output path
+def render(blocks, title, url, renderer, dpi, work_dir, output_stem):
+    start = time.monotonic()
+    prepared = prepare_images(
+        [b.image_path for b in blocks if b.image_path is not None], work_dir, dpi)
+    blocks = [b._replace(image_path=prepared.get(b.image_path))
+              for b in blocks]
+    utils.eprint(
+        f"==== prepared {len(prepared)} images in {time.monotonic() - start:.2f}s")
+
+    if renderer == config.RENDERER_PANDOC:
+        document_path = work_dir / f"{output_stem}.md"
+        output_path = Path(f"{output_stem}.pdf")
+        header = _markdown_header(title)
+        footer = ""
+        make_fragment = _markdown_block
+    elif renderer == config.RENDERER_HTML:
+        document_path = Path(f"{output_stem}.html")
+        output_path = document_path
+        header = _html_header(title)
+        footer = _HTML_FOOT
+        make_fragment = _html_block
+    else:
+        raise RuntimeError(f"unsupported renderer {renderer}")
+
+    # compare against what the last render of this document was made from
+    manifest_path = work_dir / f"{output_stem}.manifest.json"
+    manifest = {}
+    if manifest_path.is_file():
+        with open(manifest_path, 'r') as f:
+            manifest = json.loads(f.read())
+    entry = {
+        "header": _fingerprint(renderer, header, footer),
+        "blocks": [_block_fingerprint(renderer, b, url) for b in blocks],
+        "output": str(output_path.resolve()),
+    }
+    if manifest.get(renderer) == entry and document_path.is_file() and output_path.is_file():
+        utils.eprint(f"==== {output_path} is up to date")
+        return output_path
+
+    previous = manifest.get(renderer, {}).get("blocks", [])
+    changed = sum(1 for i, fp in enumerate(entry["blocks"])
+                  if i >= len(previous) or previous[i] != fp)
+    utils.eprint(
+        f"==== {changed} of {len(blocks)} blocks changed since the last render")
+
+    # each document keeps its own fragments, so they can be pruned with it
+    fragment_dir = work_dir / "fragments" / output_stem
+    fragment_dir.mkdir(parents=True, exist_ok=True)
+    fragments = []
+    rendered = 0
+    for block, fp in zip(blocks, entry["blocks"]):
+        fragment, fresh = _fragment(
+            fragment_dir, fp, lambda: make_fragment(block, url))
+        fragments += [fragment]
+        rendered += fresh
+    utils.eprint(
+        f"==== rendered {rendered} block fragments, reused {len(blocks) - rendered}")
+
+    # forget the last render until this one has produced its output, so a
+    # failure here is never mistaken for an up-to-date document
+    if manifest.pop(renderer, None) is not None:
+        _write_manifest(manifest_path, manifest)
+
+    _write_document(document_path, header, fragments, footer)
+
+    if renderer == config.RENDERER_PANDOC:
+        render_pandoc(document_path, output_path)
+
+    manifest[renderer] = entry
+    _write_manifest(manifest_path, manifest)
+    _prune_fragments(work_dir / "fragments", fragment_dir, manifest)
+
+    elapsed = time.monotonic() - start
+    size = output_path.stat().st_size
+    utils.eprint(
+        f"==== rendered {output_path} ({size / 1024 / 1024:.2f} MiB) in {elapsed:.2f}s")
+    return output_path
@@ -0,0 +1,190 @@
+import collections
+import itertools
+import json
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import talk2pdf.utils as utils
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+DEFAULT_PRIORITY = 10
+
+# finished jobs are forgotten, oldest first, beyond this many
+DEFAULT_MAX_HISTORY = 1000
+
+
+class Job(object):
+    def __init__(self, uri, title, priority):
+        self.id = uuid.uuid4().hex
+        self.uri = uri
+        self.title = title
+        self.priority = priority
+        self.status = JOB_QUEUED
+        self.error = None
+        self.output = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "uri": self.uri,
+            "title": self.title,
+            "priority": self.priority,
+            "status": self.status,
+            "error": self.error,
+            "output": None if self.output is None else str(self.output),
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+# a bounded priority queue of jobs drained by a fixed pool of worker threads.
+# lower priority values run first; equal priorities run in submission order.
+class JobQueue(object):
+    def __init__(self, run_job, workers, max_queued, max_history=DEFAULT_MAX_HISTORY):
+        self._run_job = run_job
+        self._queue = queue.PriorityQueue(maxsize=max_queued)
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._finished = collections.deque()
+        self._max_history = max_history
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    # raises queue.Full if too many jobs are already waiting
+    def submit(self, uri, title, priority=DEFAULT_PRIORITY):
+        job = Job(uri, title, priority)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait((priority, next(self._seq), job))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise
+        utils.eprint(f"==== queued job {job.id} for {uri}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stats(self):
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        for job in self.jobs():
+            counts[job.status] += 1
+        return {"depth": self._queue.qsize(), "workers": len(self._threads),
+                "jobs": counts}
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            job.status = JOB_RUNNING
+            job.started = time.time()
+            utils.eprint(f"==== start job {job.id} for {job.uri}")
+            try:
+                job.output = self._run_job(job.uri, job.title)
+                job.status = JOB_DONE
+            # the pipeline calls sys.exit on unrecoverable input
+            except (Exception, SystemExit) as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = JOB_FAILED
+            job.finished = time.time()
+            utils.eprint(
+                f"==== job {job.id} {job.status} after {job.finished - job.started:.2f}s")
+            with self._lock:
+                self._finished.append(job.id)
+                while len(self._finished) > self._max_history:
+                    del self._jobs[self._finished.popleft()]
+            self._queue.task_done()
+
+
+class _Server(ThreadingHTTPServer):
+    # submissions arrive in bursts; the default listen backlog of 5 stalls them
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_handler(jobs):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, obj):
+            raw = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["status"]:
+                self._reply(200, jobs.stats())
+            elif parts == ["jobs"]:
+                self._reply(200, [job.to_json() for job in jobs.jobs()])
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = jobs.get(parts[1])
+                if job is None:
+                    self._reply(404, {"error": f"no job {parts[1]}"})
+                else:
+                    self._reply(200, job.to_json())
+            else:
+                self._reply(404, {"error": f"no such path {self.path}"})
+
+        def do_POST(self):
+            if self.path.strip("/") != "jobs":
+                self._reply(404, {"error": f"no such path {self.path}"})
+                return
+            try:
+                body = json.loads(self.rfile.read(
+                    int(self.headers.get("Content-Length", 0))))
+                uri = body["uri"]
+                title = body.get("title")
+                priority = int(body.get("priority", DEFAULT_PRIORITY))
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": f"bad request: {e}"})
+                return
+            try:
+                job = jobs.submit(uri, title, priority)
+            except queue.Full:
+                self._reply(503, {"error": "job queue is full"})
+                return
+            self._reply(202, job.to_json())
+
+        def log_message(self, format, *args):
+            utils.eprint(f"==== {self.address_string()} {format % args}")
+
+    return Handler
+
+
+# serve until interrupted. run_job(uri, title) does the work for one job
+# and returns the path of its output
+def serve(run_job, host, port, workers, max_queued, max_history=DEFAULT_MAX_HISTORY):
+    jobs = JobQueue(run_job, workers, max_queued, max_history)
+    server = _Server((host, port), make_handler(jobs))
+    utils.eprint(
+        f"==== serving on http://{host}:{port} with {workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -9,7 +9,7 @@ def is_available():
     return cp.returncode == 0
 
 
-def extract_frame(output_dir, video_path, when_seconds):
+def _when(when_seconds):
     hh, when_seconds = divmod(when_seconds, 3600)
     mm, when_seconds = divmod(when_seconds, 60)
 
@@ -17,7 +17,12 @@ def extract_frame(output_dir, video_path, when_seconds):
     mm = int(mm)
     ss = round(when_seconds, 2)
 
-    when = f'{hh}:{mm}:{ss}'
+    return f'{hh}:{mm}:{ss}'
+
+
+# where extract_frame puts the frame of video_path at when_seconds
+def frame_path(output_dir, video_path, when_seconds):
+    when = _when(when_seconds)
 
     # hash inputs to get a unique frame name
     h = hashlib.md5()
@@ -25,9 +30,15 @@ def extract_frame(output_dir, video_path, when_seconds):
     h.update(video_path.name.encode('utf-8'))
     digest = h.hexdigest()
 
+    return output_dir / (digest + ".jpg")
+
+
+def extract_frame(output_dir, video_path, when_seconds):
+    when = _when(when_seconds)
+
     # ensure output directory exists
     output_dir.mkdir(parents=True, exist_ok=True)
-    output_path = output_dir / (digest + ".jpg")
+    output_path = frame_path(output_dir, video_path, when_seconds)
 
     if not output_path.is_file():
         # ffmpeg -y -ss 01:23:45 -i input -frames:v 1 -q:v 2 output.jpg
@@ -49,7 +60,11 @@ def video_duration(video_path):
     # ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 input.mp4
     cp = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
                         "-of", "default=noprint_wrappers=1:nokey=1", video_path], capture_output=True)
-    return float(cp.stdout.decode('utf-8').strip())
+    duration = cp.stdout.decode('utf-8').strip()
+    if cp.returncode != 0 or not duration:
+        utils.eprint(cp.stderr.decode('utf-8'))
+        raise RuntimeError(f"unable to get duration of {video_path}")
+    return float(duration)
 
 
 def audio_duration(audio_path):
@@ -1,93 +1,117 @@
 import hashlib
-import json
 import sys
 
-import openai
-
+import talk2pdf.cache as cache
+import talk2pdf.client as client
 import talk2pdf.config as config
 import talk2pdf.utils as utils
 
+_client = None
+_ca_bundle = None
 
-def transcribe(path):
 
-    # inputs to OpenAI's translate function
-    api_key = config.get(config.KEY_OPENAI_SECRET)
-    model = "whisper-1"
-    response_format = "verbose_json"
+# requests made after this verify TLS against ca_bundle
+def set_ca_bundle(ca_bundle):
+    global _client, _ca_bundle
+    if ca_bundle != _ca_bundle:
+        _ca_bundle = ca_bundle
+        _client = None
+
+
+# the shared, pooled client for all OpenAI requests
+def get_client():
+    global _client
+    if _client is None:
+        _client = client.Client(config.get(config.KEY_OPENAI_SECRET),
+                                config.get(config.KEY_OPENAI_API_BASE),
+                                ca_bundle=_ca_bundle)
+    return _client
+
+
+def report_metrics():
+    if _client is not None:
+        _client.metrics.report()
+
 
+_TRANSCRIBE_MODEL = "whisper-1"
+_TRANSCRIBE_FORMAT = "verbose_json"
+_CLEAN_MODEL = "gpt-3.5-turbo"
+
+
+# cache key for the transcript of path
+def transcribe_digest(path):
     # hash inputs as key for cache
     h = hashlib.md5()
-    h.update(api_key.encode('utf-8'))
-    h.update(model.encode('utf-8'))
+    h.update(config.get(config.KEY_OPENAI_SECRET).encode('utf-8'))
+    h.update(_TRANSCRIBE_MODEL.encode('utf-8'))
     utils.eprint(f"==== open {path} for hashing...")
     with open(path, 'rb') as f:
         h.update(f.read())
-    h.update(response_format.encode('utf-8'))
-    digest = h.hexdigest()
+    h.update(_TRANSCRIBE_FORMAT.encode('utf-8'))
+    return h.hexdigest()
+
+
+# digest is transcribe_digest(path), if the caller already has it
+def transcribe(path, digest=None):
+
+    # inputs to OpenAI's translate function
+    model = _TRANSCRIBE_MODEL
+    response_format = _TRANSCRIBE_FORMAT
+
+    if digest is None:
+        digest = transcribe_digest(path)
     utils.eprint(f"==== transcribe hash is {digest}")
-    cached_response_path = config.get(config.KEY_CACHE_DIR) / f"{digest}.json"
 
     # reach cached reponse, or cache a new response
-    if cached_response_path.is_file():
-        utils.eprint(
-            f"==== retrieving cached response from {cached_response_path}")
-        with open(cached_response_path, 'r') as f:
-            transcript = json.loads(f.read())
-    else:
+    transcript = cache.load_transcript(digest)
+    if transcript is None:
         utils.eprint(f"==== open {path} for transcription...")
-        with open(path, 'rb') as f:
-            openai.api_key = api_key
-            transcript = openai.Audio.translate(
-                model, f, response_format=response_format)
-        utils.eprint(f"==== caching response @ {cached_response_path}")
-        config.get(config.KEY_CACHE_DIR).mkdir(parents=True, exist_ok=True)
-        with open(cached_response_path, 'w') as f:
-            f.write(json.dumps(transcript))
+        transcript = get_client().translate(path, model, response_format)
+        transcript = cache.store_transcript(digest, transcript)
 
     # return the result
     return transcript
 
 
-def clean(text):
-
-    api_key = config.get(config.KEY_OPENAI_SECRET)
-    model = "gpt-3.5-turbo"
-    messages = [
+def _clean_messages(text):
+    return [
         {"role": "system", "content": "You split text into paragraphs."},
         {"role": "user", "content": f"Split the following text into paragraphs; DO NOT REMOVE TEXT, DO NOT LABEL PARAGRAPHS:\n{text}"}
     ]
 
+
+# cache key for the cleaned version of text
+def clean_digest(text):
     h = hashlib.md5()
-    h.update(api_key.encode('utf-8'))
-    h.update(model.encode('utf-8'))
-    for msg in messages:
+    h.update(config.get(config.KEY_OPENAI_SECRET).encode('utf-8'))
+    h.update(_CLEAN_MODEL.encode('utf-8'))
+    for msg in _clean_messages(text):
         h.update(msg["role"].encode('utf-8'))
         h.update(msg["content"].encode('utf-8'))
-    digest = h.hexdigest()
+    return h.hexdigest()
+
+
+def clean(text):
+
+    model = _CLEAN_MODEL
+    messages = _clean_messages(text)
+
+    digest = clean_digest(text)
     utils.eprint(f"==== clean hash is {digest}")
-    cached_response_path = config.get(config.KEY_CACHE_DIR) / f"{digest}.json"
 
-    if cached_response_path.is_file():
+    cached = cache.load_response(digest)
+    if cached is None:
         utils.eprint(
-            f"==== retrieving cached response from {cached_response_path}")
-        with open(cached_response_path, 'r') as f:
-            response = json.loads(f.read())
+            f"==== no cached response for {digest}. Submitting to OpenAI...")
+        response = get_client().chat(model, messages, temperature=0.1)
+        content = response['choices'][0]['message']['content']
+        total_tokens = int(response['usage']['total_tokens'])
+        cache.store_response(digest, content, total_tokens)
     else:
-        utils.eprint(
-            f"==== {cached_response_path} did not exist. Submitting to OpenAI...")
-        openai.api_key = api_key
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            temperature=0.1,
-        )
-        utils.eprint(f"==== caching response @ {cached_response_path}")
-        config.get(config.KEY_CACHE_DIR).mkdir(parents=True, exist_ok=True)
-        with open(cached_response_path, 'w') as f:
-            f.write(json.dumps(response))
-
-    content = response['choices'][0]['message']['content'].strip()
-    total_tokens = int(response['usage']['total_tokens'])
+        content = cached["content"]
+        total_tokens = int(cached["total_tokens"])
+
+    content = content.strip()
 
     if len(content) < len(text) * 0.95:
         utils.eprint("==== dropped too much text during cleaning!")
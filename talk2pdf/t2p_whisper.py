@@ -1,40 +1,211 @@
 import requests
 import sys
-import json
+import difflib
 import hashlib
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 import whisper
 
+from talk2pdf import cache
 from talk2pdf import config
 from talk2pdf import utils
 
 _MODEL = "base.en"
 
+# parallel transcription splits audio into windows of WINDOW_S seconds,
+# each starting OVERLAP_S seconds before the previous one ends
+WINDOW_S = 60
+OVERLAP_S = 4
+
+# how many words at a seam are compared to find duplicated text, and how
+# similar two windows' transcriptions of the overlap must be to count as one
+_SEAM_WORDS = 12
+_SEAM_MATCH = 0.6
+
+# loaded once per process and kept warm between transcriptions
+_model = None
+_model_lock = threading.Lock()
+
+# worker processes for parallel transcription, each holding its own model
+_pool = None
+_pool_workers = None
+
 
 def ensure_model():
-    whisper.load_model(_MODEL)
+    global _model
+    with _model_lock:
+        if _model is None:
+            utils.eprint(f"==== load whisper model {_MODEL}")
+            _model = whisper.load_model(_MODEL)
+    return _model
 
 
-def transcribe(path):
+def _parallel():
+    return config.get(config.KEY_WHISPER_WORKERS) > 1
 
+
+# cache key for the transcript of path
+def transcribe_digest(path):
     h = hashlib.md5()
     h.update(_MODEL.encode('utf-8'))
     with open(path, 'rb') as f:
         h.update(f.read())
-    digest = h.hexdigest()
-
-    cache_path = config.get(config.KEY_CACHE_DIR) / f"{digest}.json"
-
-    if cache_path.is_file():
-        utils.eprint(f"==== reading cached {cache_path}")
-        with open(cache_path, "r") as f:
-            result = json.loads(f.read())
-    else:
-        model = whisper.load_model("base.en")
-        result = model.transcribe(str(path), verbose=True)
-        utils.eprint(f"==== caching response @ {cache_path}")
-        with open(cache_path, 'w') as f:
-            f.write(json.dumps(result))
+    # windowed transcripts differ slightly at the seams, but not by worker count
+    if _parallel():
+        h.update(f"windows:{WINDOW_S}:{OVERLAP_S}".encode('utf-8'))
+    return h.hexdigest()
+
+
+def _init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+    ensure_model()
+
+
+def _transcribe_window(offset_s, audio):
+    result = ensure_model().transcribe(audio, verbose=None)
+    return [{"text": seg["text"],
+             "start": seg["start"] + offset_s,
+             "end": seg["end"] + offset_s} for seg in result["segments"]]
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        utils.eprint(
+            f"==== start {workers} whisper workers with {threads} threads each")
+        # torch's thread pools do not survive fork
+        _pool = ProcessPoolExecutor(max_workers=workers,
+                                    mp_context=multiprocessing.get_context(
+                                        "spawn"),
+                                    initializer=_init_worker, initargs=(threads,))
+        _pool_workers = workers
+    return _pool
+
+
+# start the worker processes and load their models ahead of the first window
+def ensure_workers(workers):
+    pool = _get_pool(workers)
+    list(pool.map(abs, range(workers)))
+    return pool
+
+
+def _words(text):
+    return text.split()
+
+
+def _normalize(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+# number of words at the start of head that repeat the end of tail. The two
+# windows rarely transcribe the overlap identically, so the repeat only has
+# to end on the same word and be similar, like paragraphs in align.py
+def _repeated_words(tail, head):
+    tail = [_normalize(w) for w in tail[-_SEAM_WORDS:]]
+    head = [_normalize(w) for w in head[:_SEAM_WORDS]]
+    for k in range(len(head), 0, -1):
+        if not tail or head[k - 1] != tail[-1]:
+            continue
+        for m in range(max(1, k - 2), min(len(tail), k + 2) + 1):
+            s = difflib.SequenceMatcher(
+                None, tail[-m:], head[:k], autojunk=False)
+            if s.ratio() >= _SEAM_MATCH:
+                return k
+    return 0
+
+
+# number of words of seg spoken before covered, assuming an even pace
+def _words_before(seg, words, covered):
+    duration = seg["end"] - seg["start"]
+    if duration <= 0:
+        return 0
+    return round(len(words) * (covered - seg["start"]) / duration)
+
+
+# join per-window segments into one list, removing text that was transcribed
+# twice where neighbouring windows overlap. windows is a list of
+# (start_s, end_s, segments) in time order
+def stitch(windows):
+    merged = []
+    for i, (start_s, end_s, segments) in enumerate(windows):
+        # segments near the end of a window are cut off mid-speech, so trust a
+        # window only up to the middle of its overlap with the next one
+        if i + 1 == len(windows):
+            owned = segments
+        else:
+            seam = (windows[i + 1][0] + end_s) / 2
+            owned = [seg for seg in segments if seg["start"] < seam]
+
+        if merged and owned:
+            covered = merged[-1]["end"]
+            # drop segments the previous window already transcribed
+            owned = [seg for seg in owned if seg["end"] > covered]
+            # and words repeated by a segment that straddles the seam,
+            # matched by text if possible and otherwise cut by time
+            if owned and owned[0]["start"] < covered:
+                head = _words(owned[0]["text"])
+                k = _repeated_words(_words(merged[-1]["text"]), head)
+                if k == 0:
+                    k = _words_before(owned[0], head, covered)
+                if k >= len(head):
+                    owned = owned[1:]
+                else:
+                    owned[0] = dict(owned[0], start=covered,
+                                    text=" " + " ".join(head[k:]))
+        merged += owned
+    return merged
+
+
+# transcribe path on fixed, overlapping windows across worker processes
+def transcribe_windows(path, workers):
+    audio = whisper.load_audio(str(path))
+    sr = whisper.audio.SAMPLE_RATE
+    duration_s = len(audio) / sr
+
+    bounds = []
+    start_s = 0
+    while True:
+        end_s = min(start_s + WINDOW_S, duration_s)
+        bounds += [(start_s, end_s)]
+        if end_s >= duration_s:
+            break
+        start_s = end_s - OVERLAP_S
+    utils.eprint(
+        f"==== transcribe {duration_s:.2f}s in {len(bounds)} windows on {workers} workers")
+
+    pool = _get_pool(workers)
+    futures = [pool.submit(_transcribe_window, lo, audio[int(lo * sr):int(hi * sr)])
+               for lo, hi in bounds]
+    windows = [(lo, hi, f.result()) for (lo, hi), f in zip(bounds, futures)]
+    segments = stitch(windows)
+    return {"text": "".join(seg["text"] for seg in segments), "segments": segments}
+
+
+# digest is transcribe_digest(path), if the caller already has it
+def transcribe(path, digest=None):
+
+    if digest is None:
+        digest = transcribe_digest(path)
+
+    result = cache.load_transcript(digest)
+    if result is None:
+        if _parallel():
+            result = transcribe_windows(
+                path, config.get(config.KEY_WHISPER_WORKERS))
+        else:
+            model = ensure_model()
+            # decoding installs hooks on the shared model, so one at a time
+            with _model_lock:
+                result = model.transcribe(str(path), verbose=True)
+        result = cache.store_transcript(digest, result)
     return result
 
 
@@ -2,6 +2,7 @@ import subprocess
 import os
 import sys
 import hashlib
+import threading
 
 from PIL import Image
 import imagehash
@@ -22,12 +23,11 @@ def at_sandia():
     return True
 
 
-def set_requests_ca_bundle():
-    _DEFAULT = os.environ["HOME"] + \
+def sandia_ca_bundle():
+    if "REQUESTS_CA_BUNDLE" in os.environ:
+        return os.environ["REQUESTS_CA_BUNDLE"]
+    return os.environ["HOME"] + \
         "/Downloads/sandia_certificate/sandia_root_ca.cer"
-    if "REQUESTS_CA_BUNDLE" not in os.environ:
-        eprint(f"==== set REQUESTS_CA_BUNDLE to {_DEFAULT}")
-        os.environ["REQUESTS_CA_BUNDLE"] = _DEFAULT
 
 
 def clear_sandia_proxies():
@@ -60,9 +60,29 @@ def copy(string):
     return cp.returncode == 0
 
 
+# a sibling of path to write before replace()ing path, unique to this process
+# and thread so concurrent writers of the same path don't clobber each other
+def tmp_path(path):
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+_keyed_locks = {}
+_keyed_locks_lock = threading.Lock()
+
+
+# the same lock for every caller with an equal key
+def keyed_lock(key):
+    with _keyed_locks_lock:
+        return _keyed_locks.setdefault(key, threading.Lock())
+
+
 def hash_file(path):
+    h = hashlib.md5()
     with open(path, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+        # in blocks, so a long recording is never in memory all at once
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
 
 
 def is_same_image(path1, path2):
@@ -0,0 +1,276 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import talk2pdf.utils as utils
+
+ITEM_PENDING = "pending"
+ITEM_CLAIMED = "claimed"
+ITEM_DONE = "done"
+ITEM_FAILED = "failed"
+
+# a claimed item whose worker has not renewed its lease in this long is
+# handed out again. workers renew several times per lease while they run
+DEFAULT_LEASE_S = 5 * 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+# a coordinator gives up if nothing finishes and no worker holds a live
+# lease for this long, e.g. because no workers are running
+DEFAULT_STALL_S = 30 * 60
+
+# a worker asked to exit when idle waits this long for a first job to be
+# published before giving up
+DEFAULT_IDLE_GRACE_S = 60
+
+# the default rollback journal, not WAL, so the file can live on NFS and
+# other shared storage that does not support WAL's shared memory
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    job TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    UNIQUE (job, kind, idx)
+)
+"""
+
+# jobs whose coordinator may still publish more items. A coordinator touches
+# its job while it works on it, so a job whose coordinator died counts as
+# closed once it has not been touched for a lease
+_JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    closed INTEGER NOT NULL DEFAULT 0,
+    touched_at REAL NOT NULL
+)
+"""
+
+
+class WorkFailed(RuntimeError):
+    pass
+
+
+# work items shared between one coordinator and any number of workers
+# through a SQLite file. Payloads and results are anything json can encode.
+class WorkQueue(object):
+    def __init__(self, path, lease_s=DEFAULT_LEASE_S, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._db = sqlite3.connect(str(path), timeout=60, isolation_level=None)
+        self._db.execute(_SCHEMA)
+        self._db.execute(_JOBS_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    # note that job is open and its coordinator alive
+    def _touch(self, job):
+        self._db.execute("""
+            INSERT INTO jobs (job, closed, touched_at) VALUES (?, 0, ?)
+            ON CONFLICT (job) DO UPDATE SET closed = 0, touched_at = excluded.touched_at
+            """, (job, time.time()))
+
+    # the coordinator of job will publish nothing more for it
+    def close_job(self, job):
+        self._db.execute(
+            "UPDATE jobs SET closed = 1 WHERE job = ?", (job,))
+
+    # how many jobs a live coordinator may still publish items for
+    def open_jobs(self):
+        n, = self._db.execute("SELECT COUNT(*) FROM jobs WHERE closed = 0 AND touched_at >= ?",
+                              (time.time() - self.lease_s,)).fetchone()
+        return n
+
+    # publish payloads as items 0..n-1 of job. Items already published with
+    # the same payload keep their state, so a restarted coordinator reuses
+    # finished work
+    def publish(self, job, kind, payloads):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._touch(job)
+            for idx, payload in enumerate(payloads):
+                self._db.execute("""
+                    INSERT INTO items (job, kind, idx, payload, status)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (job, kind, idx) DO UPDATE SET
+                        payload = excluded.payload, status = excluded.status,
+                        worker = NULL, claimed_at = NULL, attempts = 0,
+                        result = NULL, error = NULL
+                    WHERE items.payload != excluded.payload OR items.status = ?
+                    """, (job, kind, idx, json.dumps(payload), ITEM_PENDING, ITEM_FAILED))
+            self._db.execute("DELETE FROM items WHERE job = ? AND kind = ? AND idx >= ?",
+                             (job, kind, len(payloads)))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    # fail items whose lease ran out on their last attempt, which happens when
+    # the item kills its worker (out of memory, a crash in native code)
+    def _expire(self, now):
+        self._db.execute("""
+            UPDATE items SET status = ?, worker = NULL, claimed_at = NULL,
+                error = 'lease expired after ' || attempts || ' attempts'
+            WHERE status = ? AND claimed_at < ? AND attempts >= ?
+            """, (ITEM_FAILED, ITEM_CLAIMED, now - self.lease_s, self.max_attempts))
+
+    # take the oldest available item of one of kinds, or None
+    def claim(self, worker, kinds):
+        now = time.time()
+        marks = ",".join("?" * len(kinds))
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._expire(now)
+            row = self._db.execute(f"""
+                SELECT id, job, kind, idx, payload FROM items
+                WHERE kind IN ({marks}) AND (status = ?
+                    OR (status = ? AND claimed_at < ? AND attempts < ?))
+                ORDER BY id LIMIT 1
+                """, (*kinds, ITEM_PENDING, ITEM_CLAIMED, now - self.lease_s,
+                      self.max_attempts)).fetchone()
+            if row is not None:
+                self._db.execute("""
+                    UPDATE items SET status = ?, worker = ?, claimed_at = ?, attempts = attempts + 1
+                    WHERE id = ?
+                    """, (ITEM_CLAIMED, worker, now, row[0]))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {"id": row[0], "job": row[1], "kind": row[2], "idx": row[3],
+                "payload": json.loads(row[4])}
+
+    # extend worker's lease on an item. False if the lease was lost
+    def renew(self, item_id, worker):
+        cur = self._db.execute("UPDATE items SET claimed_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                               (time.time(), item_id, worker, ITEM_CLAIMED))
+        return cur.rowcount == 1
+
+    def complete(self, item_id, result):
+        self._db.execute("UPDATE items SET status = ?, result = ?, error = NULL WHERE id = ?",
+                         (ITEM_DONE, json.dumps(result), item_id))
+
+    # put the item back for another worker, unless it has failed too often.
+    # does nothing if worker's lease was lost and the item handed out again
+    def fail(self, item_id, worker, error):
+        self._db.execute("""
+            UPDATE items SET error = ?, worker = NULL, claimed_at = NULL,
+                status = CASE WHEN attempts >= ? THEN ? ELSE ? END
+            WHERE id = ? AND worker = ? AND status = ?
+            """, (error, self.max_attempts, ITEM_FAILED, ITEM_PENDING, item_id, worker, ITEM_CLAIMED))
+
+    def counts(self, job, kind):
+        rows = self._db.execute("SELECT status, COUNT(*) FROM items WHERE job = ? AND kind = ? GROUP BY status",
+                                (job, kind)).fetchall()
+        return dict(rows)
+
+    # block until every item of job has finished, and return their results in
+    # order. Raises WorkFailed if an item fails, if nothing progresses for
+    # stall_s, or after timeout_s
+    def wait(self, job, kind, poll_s=1.0, stall_s=DEFAULT_STALL_S, timeout_s=None):
+        reported = None
+        start = time.time()
+        progressed = start
+        touched = start
+        while True:
+            now = time.time()
+            # keep job open for workers waiting on its next phase
+            if now - touched > self.lease_s / 4:
+                self._touch(job)
+                touched = now
+            # expire here too, in case every worker died
+            self._expire(now)
+            counts = self.counts(job, kind)
+            live, = self._db.execute("SELECT COUNT(*) FROM items WHERE job = ? AND kind = ? AND status = ? AND claimed_at >= ?",
+                                     (job, kind, ITEM_CLAIMED, now - self.lease_s)).fetchone()
+            if counts != reported or live > 0:
+                progressed = now
+            if counts.get(ITEM_FAILED, 0) > 0:
+                errors = self._db.execute("SELECT idx, error FROM items WHERE job = ? AND kind = ? AND status = ?",
+                                          (job, kind, ITEM_FAILED)).fetchall()
+                raise WorkFailed(f"{kind} items of {job} failed: {errors}")
+            if counts != reported:
+                utils.eprint(f"==== {kind} work for {job}: {counts}")
+                reported = counts
+            if set(counts) <= {ITEM_DONE}:
+                break
+            if stall_s is not None and now - progressed > stall_s:
+                raise WorkFailed(
+                    f"{kind} work for {job} made no progress in {stall_s}s, are any workers running? {counts}")
+            if timeout_s is not None and now - start > timeout_s:
+                raise WorkFailed(
+                    f"{kind} work for {job} did not finish in {timeout_s}s: {counts}")
+            time.sleep(poll_s)
+        rows = self._db.execute("SELECT result FROM items WHERE job = ? AND kind = ? ORDER BY idx",
+                                (job, kind)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# renew worker's lease on an item every quarter lease until stop is set.
+# runs on its own thread, so it has its own connection
+def _heartbeat(path, lease_s, item_id, worker, stop):
+    queue = WorkQueue(path, lease_s)
+    try:
+        while not stop.wait(lease_s / 4):
+            if not queue.renew(item_id, worker):
+                utils.eprint(f"==== {worker} lost its lease on item {item_id}")
+                break
+    finally:
+        queue.close()
+
+
+# claim and run items until interrupted, or, when exit_when_idle, until
+# the queue has nothing left for us, no open job may publish more, and we
+# have been idle for idle_grace_s. handlers maps each kind to a function of
+# the item payload that returns its result
+def work(queue, handlers, exit_when_idle=False, poll_s=1.0, idle_grace_s=DEFAULT_IDLE_GRACE_S):
+    me = worker_id()
+    kinds = list(handlers)
+    utils.eprint(f"==== worker {me} handling {', '.join(kinds)}")
+    done = 0
+    idle_since = time.time()
+    while True:
+        item = queue.claim(me, kinds)
+        if item is None:
+            if exit_when_idle and queue.open_jobs() == 0 \
+                    and time.time() - idle_since >= idle_grace_s:
+                break
+            time.sleep(poll_s)
+            continue
+
+        utils.eprint(
+            f"==== {me} claimed {item['kind']} {item['idx']} of {item['job']}")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, daemon=True,
+                                     args=(queue.path, queue.lease_s, item["id"], me, stop))
+        heartbeat.start()
+        try:
+            result = handlers[item["kind"]](item["payload"])
+        except (Exception, SystemExit) as e:
+            utils.eprint(f"==== {item['kind']} {item['idx']} failed: {e}")
+            queue.fail(item["id"], me, f"{type(e).__name__}: {e}")
+        else:
+            queue.complete(item["id"], result)
+            done += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+        idle_since = time.time()
+    return done
@@ -21,14 +21,35 @@ def get_title(url):
         return cp.stdout.decode('utf-8').strip()
 
 
-def download(url, work_dir):
+def get_duration(url):
+    utils.eprint(f"==== get duration for {url}...")
+    cmd = ['yt-dlp', '--no-check-certificates', '--print', r'%(duration)s', url]
+    cp = subprocess.run(cmd, capture_output=True)
+    if cp.returncode != 0:
+        utils.eprint(cp.stderr)
+        utils.eprint(cp.stdout)
+        raise RuntimeError(f"unable to get duration for {url}")
+    else:
+        return float(cp.stdout.decode('utf-8').strip())
 
-    digest = hashlib.md5(url.encode('utf-8')).hexdigest()
 
+# a previous download of url in work_dir, or None
+def find_download(url, work_dir):
+    digest = hashlib.md5(url.encode('utf-8')).hexdigest()
     for f in work_dir.glob(f"{digest}.*"):
         if ".webm" in f.name:
-            utils.eprint(f"==== using already downloaded {f}")
             return f
+    return None
+
+
+def download(url, work_dir):
+
+    digest = hashlib.md5(url.encode('utf-8')).hexdigest()
+
+    f = find_download(url, work_dir)
+    if f is not None:
+        utils.eprint(f"==== using already downloaded {f}")
+        return f
 
     video_path = work_dir / (digest + r".%(ext)s")
     utils.eprint(f"==== download {url} to {video_path}")